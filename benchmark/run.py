@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+
+import httpx
+import socketio
+
+ROOT = Path(__file__).resolve().parent.parent
+
+REGEX = urllib.parse.quote(r'\bpalavra\w*', safe='')
+PAGES = [
+    '/',
+    '/corpus',
+    '/corpus/1',
+    '/document',
+    '/document/1',
+    '/ngram/1/1/3/False',
+    f'/regex_window/1/{REGEX}/False/5/5',
+    f'/regex_phrases/1/{REGEX}/False',
+    '/dictionary/1',
+    '/phrasing/1',
+]
+
+ELEMENTS = re.compile(r'parseElements\(String\.raw`(.*?)`\)', re.S)
+CLIENT_ID = re.compile(r'client_id["\']?: ?["\']([^"\']+)["\']')
+
+
+class User:
+    # a browser stand-in: fetches the page over HTTP, then opens the websocket and fires UI events like the Vue app does
+    def __init__(self, app_url: str, name: str) -> None:
+        self.app_url = app_url
+        self.name = name
+        self.http = httpx.AsyncClient(base_url=app_url, follow_redirects=False, timeout=120)
+        self.sio = None
+        self.elements = {}
+        self.events = []
+        self.ws_bytes = 0
+        self.last_message = 0.0
+
+    async def open(self, path: str) -> int:
+        response = await self.http.get(path)
+        if response.status_code != 200:
+            return response.status_code
+
+        self.elements = {int(k): v for k, v in json.loads(ELEMENTS.search(response.text).group(1)).items()}
+        self.client_id = CLIENT_ID.search(response.text).group(1)
+        self.events = []
+        self.ws_bytes = 0
+
+        self.sio = socketio.AsyncClient()
+        self.sio.on('*', self.receive)
+        await self.sio.connect(
+            f'{self.app_url}?client_id={self.client_id}',
+            socketio_path='/_nicegui_ws/socket.io',
+            headers={'Cookie': '; '.join(f'{k}={v}' for k, v in self.http.cookies.items())},
+            transports=['websocket'],
+        )
+        await self.sio.call('handshake', {'client_id': self.client_id, 'tab_id': self.name})
+        self.last_message = time.perf_counter()
+        return response.status_code
+
+    def receive(self, event: str, data) -> None:
+        self.ws_bytes += len(json.dumps(data, separators=(',', ':')))
+        self.last_message = time.perf_counter()
+        self.events.append(event)
+        if event == 'update':
+            for k, v in data.items():
+                if v is None:
+                    self.elements.pop(int(k), None)
+                else:
+                    self.elements[int(k)] = v
+
+    async def settle(self, quiet: float, timeout: float) -> float:
+        # waits until the server stops pushing updates, e.g. after timers that load data in the background
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline and time.perf_counter() - self.last_message < quiet:
+            await asyncio.sleep(quiet / 4)
+        return self.last_message
+
+    def find(self, label: str) -> int:
+        return min(k for k, v in self.elements.items() if v.get('props', {}).get('label') == label)
+
+    async def fire(self, element_id: int, event_type: str, *args) -> None:
+        listener = next(i for i in self.elements[element_id]['events'] if i['type'] == event_type)
+        await self.sio.emit('event', {
+            'id': element_id,
+            'client_id': self.client_id,
+            'listener_id': listener['listener_id'],
+            'args': [json.dumps(i) for i in args],
+        })
+
+    async def login(self, timeout: float) -> None:
+        await self.open('/login')
+        await self.fire(self.find('E-mail'), 'update:value', f'{self.name}@benchmark')
+        await self.fire(self.find('Password'), 'update:value', 'benchmark')
+        await self.fire(self.find('Log in'), 'click', {})
+
+        deadline = time.perf_counter() + timeout
+        while 'open' not in self.events:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f'{self.name} could not log in')
+            await asyncio.sleep(0.05)
+        await self.close()
+
+    async def visit(self, path: str, quiet: float, timeout: float) -> dict:
+        start = time.perf_counter()
+        status = await self.open(path)
+        loaded = time.perf_counter()
+        if status != 200:
+            return {'status': status, 'load': loaded - start, 'ready': None, 'ws_bytes': 0}
+
+        ready = await self.settle(quiet, timeout)
+        return {'status': status, 'load': loaded - start, 'ready': ready - start, 'ws_bytes': self.ws_bytes}
+
+    async def close(self) -> None:
+        if self.sio is not None:
+            await self.sio.disconnect()
+            self.sio = None
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def process_rss(pid: int) -> int | None:
+    # resident memory of the app and its children (ui.run starts the server in a reloader subprocess), Linux only
+    try:
+        pids = [pid]
+        for i in pids:
+            for task in Path(f'/proc/{i}/task').iterdir():
+                pids.extend(int(j) for j in (task / 'children').read_text().split())
+        return sum(
+            int(line.split()[1]) * 1024
+            for i in pids
+            for line in Path(f'/proc/{i}/status').read_text().splitlines()
+            if line.startswith('VmRSS:')
+        )
+    except OSError:
+        return None
+
+
+def start(args: argparse.Namespace, storage: str) -> list[subprocess.Popen]:
+    stub_env = os.environ | {
+        'STUB_PORT': str(args.stub_port),
+        'STUB_LATENCY': str(args.latency),
+        'STUB_ANALYSIS_LATENCY': str(args.analysis_latency),
+        'STUB_DOCUMENTS': str(args.documents),
+        'STUB_CONTENT_SIZE': str(args.content_size),
+        'STUB_NGRAMS': str(args.ngrams),
+        'STUB_MATCHES': str(args.matches),
+        'STUB_PHRASES': str(args.phrases),
+        'STUB_DICTIONARY': str(args.dictionary),
+        'STUB_GZIP': '0' if args.no_gzip else '1',
+        'STUB_COLUMNAR': '0' if args.json_only else '1',
+    }
+    app_env = os.environ | {
+        'CORPOGRAFO_API_URL': f'http://127.0.0.1:{args.stub_port}',
+        'NICEGUI_STORAGE_PATH': storage,
+        'NICEGUI_STORAGE_SECRET_KEY': 'benchmark',
+    }
+    output = None if args.verbose else subprocess.DEVNULL
+    return [
+        subprocess.Popen([sys.executable, str(ROOT / 'benchmark' / 'stub_api.py')], env=stub_env, stdout=output, stderr=output),
+        subprocess.Popen([sys.executable, 'main.py'], cwd=ROOT, env=app_env, stdout=output, stderr=output),
+    ]
+
+
+async def wait_for(url: str, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def benchmark(args: argparse.Namespace, app_pid: int | None) -> dict:
+    users = [User(args.app_url, f'user{i}') for i in range(args.users)]
+    await asyncio.gather(*(i.login(args.timeout) for i in users))
+    await asyncio.sleep(args.quiet)
+
+    report = {'users': args.users, 'iterations': args.iterations, 'pages': {}}
+    for page in args.pages:
+        samples = []
+        rss_per_client = []
+        for _ in range(args.iterations):
+            rss_before = process_rss(app_pid) if app_pid else None
+            samples += await asyncio.gather(*(i.visit(page, args.quiet, args.timeout) for i in users))
+            rss_after = process_rss(app_pid) if app_pid else None
+            if rss_before is not None and rss_after is not None:
+                rss_per_client.append((rss_after - rss_before) / args.users)
+            await asyncio.gather(*(i.close() for i in users))
+
+        ok = [i for i in samples if i['status'] == 200]
+        load = [i['load'] for i in ok]
+        ready = [i['ready'] for i in ok]
+        report['pages'][page] = {
+            'requests': len(samples),
+            'errors': len(samples) - len(ok),
+            'load_p50': percentile(load, 50),
+            'load_p95': percentile(load, 95),
+            'load_p99': percentile(load, 99),
+            'ready_p50': percentile(ready, 50),
+            'ready_p95': percentile(ready, 95),
+            'ws_bytes': sum(i['ws_bytes'] for i in ok) / len(ok) if ok else None,
+            'rss_per_client': max(rss_per_client) if rss_per_client else None,
+        }
+
+    await asyncio.gather(*(i.http.aclose() for i in users))
+    return report
+
+
+def print_report(report: dict) -> None:
+    def ms(value):
+        return '-' if value is None else f'{value * 1000:.0f}'
+
+    def kib(value):
+        return '-' if value is None else f'{value / 1024:.1f}'
+
+    print(f'{report["users"]} users x {report["iterations"]} iterations')
+    print(f'{"page":<48} {"err":>4} {"p50":>7} {"p95":>7} {"p99":>7} {"ready50":>8} {"ready95":>8} {"ws KiB":>8} {"RSS KiB":>8}')
+    for page, i in report['pages'].items():
+        print(
+            f'{page[:48]:<48} {i["errors"]:>4} {ms(i["load_p50"]):>7} {ms(i["load_p95"]):>7} {ms(i["load_p99"]):>7} '
+            f'{ms(i["ready_p50"]):>8} {ms(i["ready_p95"]):>8} {kib(i["ws_bytes"]):>8} {kib(i["rss_per_client"]):>8}'
+        )
+    print('latencies in ms; ws KiB is received per client per page; RSS KiB is server memory growth per connected client')
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for page, i in report['pages'].items():
+        before = baseline['pages'].get(page)
+        if before is None:
+            continue
+        for metric in ('load_p95', 'ready_p95', 'ws_bytes', 'rss_per_client'):
+            if i[metric] is not None and before[metric] and i[metric] > before[metric] * (1 + tolerance):
+                found.append(f'{page} {metric}: {before[metric]:.4g} -> {i[metric]:.4g}')
+        if i['errors'] > before['errors']:
+            found.append(f'{page} errors: {before["errors"]} -> {i["errors"]}')
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load-test the Corpografo frontend against a local stub of the API.')
+    parser.add_argument('--users', type=int, default=10, help='simulated users visiting each page at the same time')
+    parser.add_argument('--iterations', type=int, default=3, help='visits per user and page')
+    parser.add_argument('--pages', nargs='+', default=PAGES)
+    parser.add_argument('--app-url', default='http://127.0.0.1:8080')
+    parser.add_argument('--stub-port', type=int, default=5055)
+    parser.add_argument('--external', action='store_true', help='use an app and stub that are already running')
+    parser.add_argument('--latency', type=float, default=0.01, help='stub latency of ordinary endpoints, in seconds')
+    parser.add_argument('--analysis-latency', type=float, default=0.2, help='stub latency of ngram, regex, dictionary and phrasing')
+    parser.add_argument('--documents', type=int, default=500)
+    parser.add_argument('--content-size', type=int, default=200_000, help='characters of document content')
+    parser.add_argument('--ngrams', type=int, default=100_000)
+    parser.add_argument('--matches', type=int, default=10_000)
+    parser.add_argument('--phrases', type=int, default=2_000)
+    parser.add_argument('--dictionary', type=int, default=20_000)
+    parser.add_argument('--no-gzip', action='store_true', help='stub answers uncompressed')
+    parser.add_argument('--json-only', action='store_true', help='stub answers analyses in JSON even if Arrow or msgpack is accepted')
+    parser.add_argument('--quiet', type=float, default=0.5, help='seconds without websocket messages after which a page counts as ready')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='report of an earlier run; exit with an error if this run is worse')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative growth over the baseline')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the app and the stub')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as storage:
+        processes = [] if args.external else start(args, storage)
+        try:
+            asyncio.run(wait_for(f'http://127.0.0.1:{args.stub_port}/corpus', args.timeout))
+            asyncio.run(wait_for(args.app_url, args.timeout))
+            report = asyncio.run(benchmark(args, None if args.external else processes[1].pid))
+        finally:
+            for i in processes:
+                i.terminate()
+                i.wait()
+
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        found = regressions(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for i in found:
+            print(f'REGRESSION {i}')
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import hashlib
+import itertools
+import os
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+# payload sizes and latencies of the fake Corpografo API, see benchmark/run.py for the matching options
+STUB_PORT = int(os.getenv('STUB_PORT', 5055))
+STUB_LATENCY = float(os.getenv('STUB_LATENCY', 0.01))
+STUB_ANALYSIS_LATENCY = float(os.getenv('STUB_ANALYSIS_LATENCY', 0.2))
+STUB_CORPORA = int(os.getenv('STUB_CORPORA', 50))
+STUB_DOCUMENTS = int(os.getenv('STUB_DOCUMENTS', 500))
+STUB_CONTENT_SIZE = int(os.getenv('STUB_CONTENT_SIZE', 200_000))
+STUB_NGRAMS = int(os.getenv('STUB_NGRAMS', 100_000))
+STUB_MATCHES = int(os.getenv('STUB_MATCHES', 10_000))
+STUB_PHRASES = int(os.getenv('STUB_PHRASES', 2_000))
+STUB_DICTIONARY = int(os.getenv('STUB_DICTIONARY', 20_000))
+STUB_GZIP = os.getenv('STUB_GZIP', '1') == '1'
+STUB_COLUMNAR = os.getenv('STUB_COLUMNAR', '1') == '1'  # answer analyses in Arrow or msgpack when the Accept header allows it
+STUB_ETAG = os.getenv('STUB_ETAG', '1') == '1'  # tag analyses and answer 304 to a matching If-None-Match
+STUB_PAGING = os.getenv('STUB_PAGING', '0') == '1'  # answer list requests with one page of {items, total} instead of the whole list
+STUB_COUNT = os.getenv('STUB_COUNT', '1') == '1'  # answer <entity>/count; 0 answers 404, so the frontend counts the lists
+STUB_UPLOAD_ERRORS = float(os.getenv('STUB_UPLOAD_ERRORS', 0))  # share of uploads answered with a 503, to exercise retries
+
+ANALYSES = ('ngram', 'regex_window', 'regex_phrases', 'dictionary', 'phrasing')
+
+WORDS = [
+    'a', 'corpus', 'de', 'documento', 'em', 'frase', 'language', 'linguística', 'o', 'palavra',
+    'que', 'texto', 'the', 'um', 'uma', 'word', 'análise', 'para', 'com', 'não',
+]
+
+app = FastAPI()
+if STUB_GZIP:
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=1)
+
+
+def words(n: int) -> list[str]:
+    # deterministic vocabulary that grows past the base words so every term is distinct
+    return [f'{WORDS[i % len(WORDS)]}{i // len(WORDS) or ""}' for i in range(n)]
+
+
+def text(size: int) -> str:
+    return ''.join(itertools.islice(itertools.cycle(' '.join(WORDS) + '. '), size))
+
+
+def entities(prefix: str, n: int) -> list[dict]:
+    return [{'id': i, 'name': f'{prefix} {i}'} for i in range(1, n + 1)]
+
+
+corpora = entities('Corpus', STUB_CORPORA)
+documents = entities('Document', STUB_DOCUMENTS)
+content = text(STUB_CONTENT_SIZE)
+input_file = base64.b64encode(content.encode()).decode()
+ngrams = {term: STUB_NGRAMS - i for i, term in enumerate(words(STUB_NGRAMS))}
+matches = {term: i % 97 + 1 for i, term in enumerate(words(STUB_MATCHES))}
+phrases = [text(80 + i % 120) for i in range(STUB_PHRASES)]
+dictionary = {term: i % 53 + 1 for i, term in enumerate(words(STUB_DICTIONARY))}
+
+
+# results never change while the stub runs, so a tag only depends on the request and this run
+run_id = os.urandom(8).hex()
+
+
+def analysis_etag(request: Request) -> str:
+    return '"' + hashlib.sha1(f'{run_id} {request.url} {request.headers.get("accept", "")}'.encode()).hexdigest()[:20] + '"'
+
+
+def analysis(request: Request, name: str, result: dict | list) -> Response:
+    if STUB_ETAG:
+        etag = analysis_etag(request)
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers={'ETag': etag})
+        response = untagged_analysis(request, name, result)
+        response.headers['ETag'] = etag
+        return response
+    return untagged_analysis(request, name, result)
+
+
+def untagged_analysis(request: Request, name: str, result: dict | list) -> Response:
+    accept = request.headers.get('accept', '') if STUB_COLUMNAR else ''
+
+    if 'application/vnd.apache.arrow.stream' in accept and pyarrow is not None:
+        columns = {'term': list(result), 'frequency': list(result.values())} if isinstance(result, dict) else {'phrase': result}
+        table = pyarrow.table(columns).replace_schema_metadata({'name': name})
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type='application/vnd.apache.arrow.stream')
+
+    if 'application/msgpack' in accept and msgpack is not None:
+        body = {'terms': list(result), 'frequencies': list(result.values())} if isinstance(result, dict) else result
+        return Response(msgpack.packb([name, body]), media_type='application/msgpack')
+
+    return JSONResponse([name, result])
+
+
+@app.middleware('http')
+async def simulate_latency(request: Request, call_next):
+    analysis = request.url.path.strip('/').split('/')[0] in ANALYSES
+    # checking a tag is cheap for the real backend, which only has to look at the document or corpus version
+    revalidation = STUB_ETAG and request.headers.get('if-none-match') == analysis_etag(request)
+    await asyncio.sleep(STUB_ANALYSIS_LATENCY if analysis and not revalidation else STUB_LATENCY)
+    return await call_next(request)
+
+
+@app.post('/login')
+async def login(request: Request):
+    email = (await request.json())['email']
+    return {'access_token': f'benchmark-{email}', 'name': email}
+
+
+@app.post('/logout')
+def logout():
+    return {}
+
+
+def listing(items: list[dict], page: int, per_page: int, filter: str) -> list[dict] | dict:
+    if not STUB_PAGING:
+        return items
+    matches = [i for i in items if filter.lower() in i['name'].lower()]
+    return {'items': matches[(page - 1) * per_page:page * per_page], 'total': len(matches)}
+
+
+# declared before the /<entity>/{id} routes, which would otherwise take 'count' for an id and answer 422
+@app.get('/{entity}/count')
+def count(entity: str):
+    collection = {'corpus': corpora, 'document': documents}.get(entity)
+    if not STUB_COUNT or collection is None:
+        return Response(status_code=404)
+    return {'count': len(collection)}
+
+
+@app.get('/corpus')
+def list_corpora(page: int = 1, per_page: int = 10, filter: str = ''):
+    return listing(corpora, page, per_page, filter)
+
+
+@app.get('/corpus/{corpus_id}')
+def get_corpus(corpus_id: int):
+    return {'id': corpus_id, 'name': f'Corpus {corpus_id}', 'documents': documents[:STUB_DOCUMENTS // 10], 'users': []}
+
+
+@app.get('/document')
+def list_documents(page: int = 1, per_page: int = 10, filter: str = ''):
+    return listing(documents, page, per_page, filter)
+
+
+@app.get('/document/{document_id}')
+def get_document(document_id: int, exclude: str = ''):
+    document = {
+        'id': document_id, 'name': f'Document {document_id}', 'language_id': 1, 'source_id': 1, 'publisher_id': 1,
+        'citation': '', 'content': content, 'input_file': input_file,
+        'corpora': corpora[:5], 'authors': [], 'users': [],
+    }
+    return {k: v for k, v in document.items() if k not in exclude.split(',')}
+
+
+uploads = itertools.count()
+
+
+@app.post('/document')
+async def create_document(request: Request):
+    async for _ in request.stream():
+        pass
+    if random.random() < STUB_UPLOAD_ERRORS:
+        return JSONResponse({'message': 'Service unavailable'}, status_code=503)
+    # new documents reuse existing ids, so they can be linked and opened like any other
+    return JSONResponse({'id': next(uploads) % STUB_DOCUMENTS + 1}, status_code=201)
+
+
+@app.post('/corpus/{corpus_id}/document/{document_id}')
+@app.delete('/corpus/{corpus_id}/document/{document_id}')
+@app.post('/author/{author_id}/document/{document_id}')
+@app.delete('/author/{author_id}/document/{document_id}')
+def link_document(document_id: int):
+    if document_id > STUB_DOCUMENTS:
+        return JSONResponse({'message': 'Document not found'}, status_code=404)
+    return {}
+
+
+@app.get('/language')
+@app.get('/organization')
+def list_options():
+    return entities('Option', 20)
+
+
+@app.get('/ngram/{corpus_id}/{min_len}/{max_len}/{case_sensitive}')
+def ngram(request: Request, corpus_id: int, min_len: int, max_len: int, case_sensitive: str):
+    return analysis(request, f'Corpus {corpus_id}', ngrams)
+
+
+@app.get('/regex_window/{corpus_id}/{regex}/{case_sensitive}/{left_window_size}/{right_window_size}')
+def regex_window(request: Request, corpus_id: int, regex: str, case_sensitive: str, left_window_size: int, right_window_size: int):
+    return analysis(request, f'Corpus {corpus_id}', matches)
+
+
+@app.get('/regex_phrases/{corpus_id}/{regex}/{case_sensitive}')
+def regex_phrases(request: Request, corpus_id: int, regex: str, case_sensitive: str):
+    return analysis(request, f'Corpus {corpus_id}', phrases)
+
+
+@app.get('/dictionary/{document_id}')
+def get_dictionary(request: Request, document_id: int):
+    return analysis(request, f'Document {document_id}', dictionary)
+
+
+@app.get('/phrasing/{document_id}')
+def get_phrasing(request: Request, document_id: int):
+    return analysis(request, f'Document {document_id}', phrases)
+
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='127.0.0.1', port=STUB_PORT, log_level='warning')
@@ -0,0 +1,70 @@
+import sys
+import time
+from collections import OrderedDict
+
+from collections.abc import Callable, Hashable
+from typing import Any
+
+
+def estimate_size(value: Any) -> int:
+    # rough deep size of JSON-like values, good enough for a memory budget; Arrow arrays report their buffers
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(i) for i in value)
+    return size
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, max_bytes: int | None = None, sizeof: Callable[[Any], int] = estimate_size) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._items: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._items.get(key)
+        if item is None:
+            return default
+
+        expires, _, value = item
+        if expires < time.monotonic():
+            self.pop(key)
+            return default
+
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.pop(key)
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        self._items[key] = (time.monotonic() + self.ttl, size, value)
+        self.bytes += size
+
+        while len(self._items) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, (_, size, _) = self._items.popitem(last=False)
+            self.bytes -= size
+
+    def pop(self, key: Hashable) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> None:
+        for key in [i for i in self._items if predicate(i)]:
+            self.pop(key)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self.bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self._items)
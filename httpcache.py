@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import threading
+import time
+
+from nicegui import json
+
+HTTP_CACHE_PATH = os.getenv('HTTP_CACHE_PATH', os.path.join(os.getenv('NICEGUI_STORAGE_PATH', '.nicegui'), 'http-cache.db'))
+HTTP_CACHE_BYTES = int(os.getenv('HTTP_CACHE_BYTES', 1024 * 1024 * 1024))
+
+# response headers kept with a body; the body is stored decoded, so Content-Encoding and Content-Length are not
+KEPT_HEADERS = ('content-type', 'etag', 'last-modified')
+
+
+class ResponseCache:
+    # GET responses with validators, kept on disk across restarts and shared by the workers of a machine;
+    # the least recently used ones are evicted once the bodies take more than `max_bytes`
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS response (key TEXT PRIMARY KEY, headers TEXT NOT NULL, body BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS response_used ON response (used)')
+
+    def connection(self) -> sqlite3.Connection:
+        # one connection per thread, since lookups run in worker threads
+        if not hasattr(self.local, 'db'):
+            self.local.db = sqlite3.connect(self.path, timeout=10)
+            self.local.db.execute('PRAGMA journal_mode=WAL')
+            self.local.db.execute('PRAGMA synchronous=NORMAL')
+        return self.local.db
+
+    def get(self, key: str) -> tuple[dict[str, str], bytes] | None:
+        row = self.connection().execute('SELECT headers, body FROM response WHERE key = ?', (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def touch(self, key: str) -> None:
+        with self.connection() as db:
+            db.execute('UPDATE response SET used = ? WHERE key = ?', (time.time(), key))
+
+    def put(self, key: str, headers: dict[str, str], body: bytes) -> None:
+        with self.connection() as db:
+            db.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?)', (key, json.dumps(headers), body, len(body), time.time()))
+            db.execute(
+                'DELETE FROM response WHERE key IN ('
+                'SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY used DESC, key) AS total FROM response) WHERE total > ?)',
+                (self.max_bytes,),
+            )
+
+
+def cache_key(url: str, headers: dict[str, str]) -> str:
+    # the same endpoint can answer in several encodings, depending on what was asked for
+    return f'{url} {headers.get("Accept", "")}'
+
+
+def kept_headers(headers) -> dict[str, str]:
+    return {i: headers[i] for i in KEPT_HEADERS if i in headers}
+
+
+response_cache = ResponseCache(HTTP_CACHE_PATH, HTTP_CACHE_BYTES) if HTTP_CACHE_PATH else None
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import secrets
+import time
+
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from nicegui import background_tasks
+
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', 2))
+JOBS_KEPT_PER_USER = int(os.getenv('JOBS_KEPT_PER_USER', 20))
+JOB_TTL = float(os.getenv('JOB_TTL', 24 * 60 * 60))
+JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT', 600))
+JOB_PRUNE_INTERVAL = float(os.getenv('JOB_PRUNE_INTERVAL', 60))
+
+
+class JobLimitError(Exception):
+    pass
+
+
+class Job:
+    # an analysis running in the background; `render` shows its result on a page once it is done
+    def __init__(self, owner: str | None, title: str, render: Callable[[Any], Awaitable[None]]) -> None:
+        self.id = secrets.token_urlsafe(8)
+        self.owner = owner
+        self.title = title
+        self.render = render
+        self.status = 'running'
+        self.started = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    async def run(self, work: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            self.result = await work()
+            self.status = 'done'
+        except Exception as e:
+            self.error = str(e) or type(e).__name__
+            self.status = 'failed'
+        finally:
+            self.finished = time.time()
+
+
+jobs: dict[str, Job] = {}
+
+
+def user_jobs(owner: str | None) -> list[Job]:
+    return sorted((i for i in jobs.values() if i.owner == owner), key=lambda i: i.started, reverse=True)
+
+
+def prune(owner: str | None) -> None:
+    # finished jobs are kept for a while so their results can be revisited, but only the newest few per user
+    finished = [i for i in user_jobs(owner) if i.status != 'running']
+    for n, job in enumerate(finished):
+        if n >= JOBS_KEPT_PER_USER or time.time() - job.finished > JOB_TTL:
+            del jobs[job.id]
+
+
+async def prune_all() -> None:
+    # results of users who never submit another analysis would otherwise be kept until the process restarts
+    while True:
+        await asyncio.sleep(JOB_PRUNE_INTERVAL)
+        for owner in {i.owner for i in jobs.values()}:
+            prune(owner)
+
+
+def submit(owner: str | None, title: str, work: Callable[[], Awaitable[Any]], render: Callable[[Any], Awaitable[None]]) -> Job:
+    prune(owner)
+    if sum(i.status == 'running' for i in user_jobs(owner)) >= MAX_JOBS_PER_USER:
+        raise JobLimitError(f'There are already {MAX_JOBS_PER_USER} analyses running, wait for one of them to finish')
+
+    job = Job(owner, title, render)
+    jobs[job.id] = job
+    background_tasks.create(job.run(work), name=f'job {job.id}')
+    return job
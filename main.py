@@ -1,12 +1,15 @@
+import asyncio
 import os
 import secrets
+import time
 
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from functools import partial
+from nicegui import app, background_tasks, ui
 
-from nicegui import app, ui
-
-from util import api_request
+import jobs
+import metrics
+import sessions
+import util
 
 from resources import *
 
@@ -14,11 +17,29 @@ from util import make_header_and_menu
 
 from starlette.formparsers import MultiPartParser
 
-MultiPartParser.max_file_size = 1024 * 1024 * 10  # 10 MB
+MultiPartParser.max_file_size = 1024 * 1024  # uploads above 1 MB are spooled to disk, see MAX_UPLOAD_SIZE for the limit
 
 app.add_middleware(login.AuthMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+PORT = int(os.getenv('PORT', 8080))
+RELOAD = os.getenv('RELOAD', '1') == '1'
+SESSION_STORE = os.getenv('SESSION_STORE')  # e.g. sqlite:///sessions.db, shared by every worker behind the proxy
+
+NICEGUI_STORAGE_SECRET_KEY = os.getenv('NICEGUI_STORAGE_SECRET_KEY')
+if NICEGUI_STORAGE_SECRET_KEY is None:
+    if SESSION_STORE:
+        # every worker has to accept the session cookies signed by the others, and after restarts
+        raise SystemExit('NICEGUI_STORAGE_SECRET_KEY must be set when SESSION_STORE is')
+    NICEGUI_STORAGE_SECRET_KEY = str(secrets.SystemRandom().getrandbits(2**8))
+
+if SESSION_STORE:
+    app.storage = sessions.SharedStorage(sessions.open_store(SESSION_STORE))
+    app.on_startup(partial(asyncio.to_thread, app.storage.store.purge, sessions.SESSION_TTL))
+    app.on_startup(lambda: background_tasks.create(app.storage.sync(), name='sync sessions'))
+    app.add_middleware(sessions.SessionLoadingMiddleware, storage=app.storage)
 
-NICEGUI_STORAGE_SECRET_KEY = os.getenv('NICEGUI_STORAGE_SECRET_KEY', str(secrets.SystemRandom().getrandbits(2**8)))
+app.on_startup(lambda: background_tasks.create(jobs.prune_all(), name='prune jobs'))
 
 ui.menu_item.default_props('dense')
 ui.menu_item.default_classes('w-full')
@@ -27,20 +48,41 @@ ui.input.default_classes('w-full')
 #ui.button.default_classes('w-full')
 
 @ui.page('/')
-def main_page() -> None:
+async def main_page() -> None:
     make_header_and_menu()
-    user_corpora = api_request('get', 'corpus').json()
-    user_documents = api_request('get', 'document').json()
+    totals = app.storage.user.get('totals', {})
 
     with ui.card().classes('absolute-center items-center'):
         ui.label('Totals').style('font-size: 150%')
-        ui.label(f'Corpora: {len(user_corpora)} items')
-        ui.label(f'Documents: {len(user_documents)} items')
+        corpora_label = ui.label()
+        documents_label = ui.label()
+        status_label = ui.label().classes('text-xs text-grey')
+
+    def show_totals(totals, status=''):
+        corpora_label.set_text(f'Corpora: {totals.get("corpus", "...")} items')
+        documents_label.set_text(f'Documents: {totals.get("document", "...")} items')
+        status_label.set_text(status)
+
+    async def refresh_totals():
+        corpora, documents = await asyncio.gather(util.fetch_count('corpus'), util.fetch_count('document'))
+        if corpora is None or documents is None:
+            show_totals(totals, 'Totals may be outdated')
+        else:
+            app.storage.user['totals'] = {'corpus': corpora, 'document': documents, 'updated': time.time()}
+            show_totals(app.storage.user['totals'])
+
+    # render whatever is cached right away and revalidate in the background once it gets old
+    if time.time() - totals.get('updated', 0) > util.TOTALS_TTL:
+        show_totals(totals, 'Updating...')
+        ui.timer(0, refresh_totals, once=True)
+    else:
+        show_totals(totals)
 
 
 ui.run(
     host='0.0.0.0',
-    #port=80,
+    port=PORT,
+    reload=RELOAD,
     storage_secret=NICEGUI_STORAGE_SECRET_KEY,
     title = 'Corpografo (dev)',
 )
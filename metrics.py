@@ -0,0 +1,180 @@
+import bisect
+import re
+import time
+import urllib.parse
+
+from nicegui import Client, app, core
+from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2 ** i for i in range(8, 28, 2))  # 256 B .. 32 MB
+
+# path segments kept verbatim in endpoint templates; numbers become {id} and anything else {param}
+ENDPOINT_WORDS = {
+    'author', 'corpus', 'count', 'dictionary', 'document', 'language', 'login', 'logout',
+    'ngram', 'organization', 'phrasing', 'regex_phrases', 'regex_window', 'register', 'user',
+}
+
+
+def endpoint_template(endpoint: str) -> str:
+    segments = urllib.parse.urlsplit(endpoint).path.strip('/').split('/')
+    return '/'.join(
+        i if n == 0 or i in ENDPOINT_WORDS else '{id}' if i.isdigit() else '{param}'
+        for n, i in enumerate(segments)
+    )
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        registry.append(self)
+
+    def key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[i]) for i in self.labels)
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        return super().render() + [
+            f'{self.name}{format_labels(dict(zip(self.labels, k)))} {v}' for k, v in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # per label set: non-cumulative bucket counts (the last one is +Inf), sum and count
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.key(labels)
+        if key not in self.values:
+            self.values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+        counts, totals = self.values[key]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, (counts, (total, count)) in self.values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels(labels | {"le": bound})} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+
+registry: list[Metric] = []
+
+backend_latency = Histogram(
+    'corpografo_backend_request_seconds', 'Latency of backend API requests.', ('method', 'endpoint', 'status'))
+backend_size = Histogram(
+    'corpografo_backend_response_bytes', 'Size of backend API response bodies.', ('method', 'endpoint'), SIZE_BUCKETS)
+page_latency = Histogram(
+    'corpografo_page_render_seconds', 'Time to build and serve a page.', ('route', 'status'))
+connected_clients = Gauge(
+    'corpografo_connected_clients', 'Number of clients with an open websocket.')
+connected_clients.set(0)
+websocket_size = Histogram(
+    'corpografo_websocket_message_bytes', 'Size of messages sent to clients over the websocket.', ('type',), SIZE_BUCKETS)
+
+
+def observe_backend_request(method: str, endpoint: str, status: int | str, seconds: float, size: int | None) -> None:
+    template = endpoint_template(endpoint)
+    backend_latency.observe(seconds, method=method.upper(), endpoint=template, status=status)
+    if size is not None:
+        backend_size.observe(size, method=method.upper(), endpoint=template)
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start = time.perf_counter()
+        response = await call_next(request)
+
+        # redirects from the auth middleware never reach the router, so fall back to the literal path
+        route = request.scope['route'].path if 'route' in request.scope else request.url.path
+        if route in Client.page_routes.values():
+            page_latency.observe(time.perf_counter() - start, route=route, status=response.status_code)
+
+        return response
+
+
+# connect handlers run again on every reconnect, so count distinct clients rather than events
+connected_client_ids: set[str] = set()
+
+def client_connected(client: Client) -> None:
+    connected_client_ids.add(client.id)
+    connected_clients.set(len(connected_client_ids))
+
+def client_disconnected(client: Client) -> None:
+    connected_client_ids.discard(client.id)
+    connected_clients.set(len(connected_client_ids))
+
+app.on_connect(client_connected)
+app.on_disconnect(client_disconnected)
+
+
+# event name at the start of an encoded Socket.IO packet, e.g. 2["update",{...}] or 2/namespace,["update",...]
+PACKET_EVENT = re.compile(r'\d+(?:/[^,]*,)?\d*\["([^"]+)"')
+
+
+def measure_websocket() -> None:
+    # measured at the Engine.IO layer, where messages are already encoded, so sizing them costs no extra serialization
+    send_packet = core.sio.eio.send_packet
+
+    async def measured_send_packet(sid, pkt):
+        if isinstance(pkt.data, str):
+            match = PACKET_EVENT.match(pkt.data)
+            websocket_size.observe(len(pkt.data), type=match.group(1) if match else 'other')
+        elif isinstance(pkt.data, bytes):
+            websocket_size.observe(len(pkt.data), type='binary')
+        return await send_packet(sid, pkt)
+
+    core.sio.eio.send_packet = measured_send_packet
+
+app.on_startup(measure_websocket)
+
+
+@app.get('/metrics')
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse('\n'.join(j for i in registry for j in i.render()) + '\n', media_type='text/plain; version=0.0.4')
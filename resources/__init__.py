@@ -1 +1 @@
-from resources import corpus, document, language, login, organization, author
\ No newline at end of file
+from resources import corpus, document, job, language, login, organization, author
\ No newline at end of file
@@ -1,4 +1,5 @@
 
+from functools import partial
 from nicegui import ui, events
 import util
 
@@ -16,7 +17,7 @@ ui.page('/author/{entity_id}')(util.make_generic_detail_entity_page('author', {
     'email': {'input_type': 'input'},
     'organization_id': {
         'input_type': 'select',
-        'options_maker': lambda: {None: 'Undefined'} | {i['id']:i['name'] for i in util.api_request('get', 'organization').json()},
+        'options_maker': partial(util.entity_options, 'organization'),
         'input_kwargs': {'label': 'Organization'},
         'entity': 'organization',
     },
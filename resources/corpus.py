@@ -1,9 +1,18 @@
+import asyncio
+import os
+import re
 import urllib.parse
 from functools import partial
 from nicegui import ui
 from util import api_request
+import jobs
+import tables
+import termmatrix
 import util
 
+NGRAM_TOP_K = int(os.getenv('NGRAM_TOP_K', 10000))
+CORPUS_DICTIONARY_CONCURRENCY = int(os.getenv('CORPUS_DICTIONARY_CONCURRENCY', 8))
+
 ui.page('/corpus')(util.make_generic_list_entity_page('corpus', 'Corpora'))
 
 ui.page('/new_corpus')(util.make_generic_new_entity_page('corpus', {'name': {'input_type': 'input'}}))
@@ -21,7 +30,71 @@ async def ngram_analysis_setup(corpus_id):
     settings = await dialog
 
     if settings is not None:
-        ui.navigate.to(f'/ngram/{corpus_id}/{settings[0]["min"]}/{settings[0]["max"]}/{settings[1]}')
+        min_len, max_len, case_sensitive = settings[0]['min'], settings[0]['max'], settings[1]
+        query = urllib.parse.urlencode({'top': NGRAM_TOP_K, 'min_frequency': 1})
+        submit_analysis(
+            f'N-grams ({min_len} to {max_len}) of corpus {corpus_id}',
+            partial(fetch_ngrams, corpus_id, f'/ngram/{corpus_id}/{min_len}/{max_len}/{case_sensitive}?{query}', NGRAM_TOP_K, 1),
+            partial(show_ngrams, corpus_id, min_len, max_len, case_sensitive, NGRAM_TOP_K, 1),
+        )
+
+async def fetch_analysis(corpus_id, endpoint, cache_key=None):
+    # runs outside of any page, so a failure becomes the job's error instead of a notification
+    response = await util.coalesced_request('get', endpoint, f'corpus/{corpus_id}', timeout=jobs.JOB_TIMEOUT, headers=util.ANALYSIS_HEADERS, revalidate=True)
+    if response.status_code != 200:
+        result = response.json()
+        raise RuntimeError(result.get('message', result) if isinstance(result, dict) else result)
+
+    result = util.decode_analysis(response)
+    if cache_key is None:
+        return result
+
+    # kept in the shared cache alone, where REGEX_CACHE_BYTES bounds it; the job's page reads it back from there
+    util.regex_cache.set(cache_key, {'result': result, 'scopes': {util.user_scope()}})
+
+async def fetch_ngrams(corpus_id, endpoint, top, min_frequency):
+    # only the kept n-grams outlive the job, not the whole result of the backend
+    name, ngrams = await fetch_analysis(corpus_id, endpoint)
+    return name, await asyncio.to_thread(tables.FrequencyTable, ngrams, 'ngram', top, min_frequency)
+
+def submit_analysis(title, work, render):
+    try:
+        job = jobs.submit(util.user_scope(), title, work, render)
+    except jobs.JobLimitError as e:
+        ui.notify(str(e), color='negative')
+    else:
+        ui.navigate.to(f'/job/{job.id}')
+
+def regex_request(corpus_id, regex, case_sensitive, left_window_size=None, right_window_size=None):
+    # the regex_cache key and endpoint of a regex analysis, by window or by phrase when there are no window sizes;
+    # the endpoint is also the path of the page that shows it
+    key = (corpus_id, regex, case_sensitive, left_window_size, right_window_size)
+    if left_window_size is None:
+        return key, f'/regex_phrases/{corpus_id}/{urllib.parse.quote(regex, safe="")}/{case_sensitive}'
+    return key, f'/regex_window/{corpus_id}/{urllib.parse.quote(regex, safe="")}/{case_sensitive}/{left_window_size}/{right_window_size}'
+
+async def render_regex(corpus_id, regex, case_sensitive, left_window_size=None, right_window_size=None):
+    result = await util.cached_analysis(util.regex_cache, *regex_request(corpus_id, regex, case_sensitive, left_window_size, right_window_size))
+    if result is None:
+        return
+    if left_window_size is None:
+        await show_regex_phrases(corpus_id, regex, result)
+    else:
+        await show_regex_window(corpus_id, regex, result)
+
+def regex_error(regex):
+    # patterns are checked here so that invalid ones never reach the backend
+    if not regex:
+        return 'empty pattern'
+    try:
+        re.compile(regex)
+    except re.error as e:
+        return str(e)
+
+def show_regex_error(corpus_id, regex, error):
+    with ui.card().classes('absolute-center items-center'):
+        ui.label(f'Invalid regular expression {regex!r}: {error}')
+        ui.button('Detail corpus', on_click=partial(ui.navigate.to, f'/corpus/{corpus_id}'))
 
 async def regex_matching_setup(corpus_id):
     with ui.dialog() as dialog, ui.card():
@@ -50,16 +123,86 @@ async def regex_matching_setup(corpus_id):
 
     settings = await dialog
 
-    if settings is not None:
+    if settings is not None and (error := regex_error(settings[1])) is not None:
+        ui.notify(f'Invalid regular expression: {error}', color='negative')
+
+    elif settings is not None:
         #ui.notify(settings)
-        if settings[0]:
-            ui.navigate.to(f'/regex_window/{corpus_id}/{urllib.parse.quote(settings[1])}/{settings[2]}/{settings[3]}/{settings[4]}')
+        window, regex, case_sensitive, left_window_size, right_window_size = settings
+        if not window:
+            left_window_size = right_window_size = None
+        key, endpoint = regex_request(corpus_id, regex, case_sensitive, left_window_size, right_window_size)
+
+        if key in util.regex_cache:
+            # computed before, maybe for someone else: the page checks the access and shows it without a job
+            ui.navigate.to(endpoint)
         else:
-            ui.navigate.to(f'/regex_phrases/{corpus_id}/{urllib.parse.quote(settings[1])}/{settings[2]}')
+            submit_analysis(
+                f'Regex matching ({"window" if window else "phrases"}) of corpus {corpus_id}: {regex}',
+                partial(fetch_analysis, corpus_id, endpoint, key),
+                lambda _: render_regex(corpus_id, regex, case_sensitive, left_window_size, right_window_size),
+            )
+
+async def fetch_corpus_dictionary(corpus_id):
+    # the dictionaries of every document in the corpus, at most CORPUS_DICTIONARY_CONCURRENCY at a time, merged into one matrix
+    headers = util.auth_headers()
+    response = await util.send_request('get', f'corpus/{corpus_id}', headers=headers, json={})
+    if response.status_code != 200:
+        raise RuntimeError(util.error_message(response))
+    corpus = response.json()
+    semaphore = asyncio.Semaphore(CORPUS_DICTIONARY_CONCURRENCY)
+
+    async def fetch_dictionary(document_id):
+        async with semaphore:
+            response = await util.send_request(
+                'get', f'dictionary/{document_id}', headers=headers | util.ANALYSIS_HEADERS, timeout=jobs.JOB_TIMEOUT, revalidate=True, json={},
+            )
+        if response.status_code != 200:
+            raise RuntimeError(f'Dictionary of document {document_id}: {util.error_message(response)}')
+        return util.decode_analysis(response)[1]
+
+    dictionaries = await asyncio.gather(*(fetch_dictionary(i['id']) for i in corpus['documents']))
+    return corpus['name'], len(dictionaries), await asyncio.to_thread(termmatrix.term_statistics, dictionaries)
+
+async def show_corpus_dictionary(corpus_id, result):
+    name, documents, statistics = result
+    terms = tables.ArrayRows(statistics, 'term')
+
+    with ui.card().classes('w-2/3 h-5/6 absolute-center items-center no-shadow'):
+        with ui.scroll_area().classes('w-full h-full'):
+
+            ui.button('Detail corpus', on_click=partial(ui.navigate.to, f'/corpus/{corpus_id}'))
+            ui.label(f'{len(statistics["term"])} distinct terms in {documents} documents')
+
+            table = (await tables.make_server_side_table(
+                [
+                    {'name': 'term', 'label': 'Term', 'field': 'term', 'sortable': True},
+                    {'name': 'frequency', 'label': 'Frequency', 'field': 'frequency', 'sortable': True},
+                    {'name': 'documents', 'label': 'Documents', 'field': 'documents', 'sortable': True},
+                    {'name': 'tf_idf', 'label': 'Mean TF-IDF', 'field': 'tf_idf', 'sortable': True},
+                ],
+                terms.fetch_page,
+                title=f'Dictionary: {name}',
+                row_key='term',
+                sort_by='frequency',
+                descending=True,
+            )).classes('w-full')
+
+            with table.add_slot('top-right'), ui.row().classes('items-center no-wrap'):
+                tables.filter_input(table)
+                tables.export_button(table, terms, f'dictionary_corpus_{corpus_id}')
+
+def corpus_dictionary_analysis(corpus_id):
+    submit_analysis(
+        f'Dictionary of corpus {corpus_id}',
+        partial(fetch_corpus_dictionary, corpus_id),
+        partial(show_corpus_dictionary, corpus_id),
+    )
 
 def make_menu_corpus_detailing(corpus_id):
     ui.menu_item('N-grams analysis', partial(ngram_analysis_setup, corpus_id), auto_close=False)
     ui.menu_item('Regex matching', partial(regex_matching_setup, corpus_id), auto_close=False)
+    ui.menu_item('Dictionary', partial(corpus_dictionary_analysis, corpus_id))
 
 ui.page('/corpus/{entity_id}')(util.make_generic_detail_entity_page(
     'corpus',
@@ -77,90 +220,128 @@ ui.page('/corpus/{entity_id}')(util.make_generic_detail_entity_page(
 ))
 
 @ui.page('/ngram/{corpus_id:int}/{min_len:int}/{max_len:int}/{case_sensitive}')
-def manage_corpus(corpus_id, min_len, max_len, case_sensitive):
+async def manage_corpus(corpus_id, min_len, max_len, case_sensitive, top: int = NGRAM_TOP_K, min_frequency: int = 1):
     util.make_header_and_menu()
 
-    name, ngrams = util.api_request('get', f'/ngram/{corpus_id}/{min_len}/{max_len}/{case_sensitive}').json()
+    query = urllib.parse.urlencode({'top': top, 'min_frequency': min_frequency})
+    result = await util.request_analysis(f'/ngram/{corpus_id}/{min_len}/{max_len}/{case_sensitive}?{query}', coalesce=f'corpus/{corpus_id}')
+    if result is None:
+        return
+    await show_ngrams(corpus_id, min_len, max_len, case_sensitive, top, min_frequency, result)
+
+async def show_ngrams(corpus_id, min_len, max_len, case_sensitive, top, min_frequency, result):
+    # a finished job has already cut the result down to a FrequencyTable
+    name, ngrams = result
+    if not isinstance(ngrams, tables.FrequencyTable):
+        ngrams = tables.FrequencyTable(ngrams, 'ngram', top, min_frequency)
 
     with ui.card().classes('w-2/3 h-5/6 absolute-center items-center no-shadow'):
         with ui.scroll_area().classes('w-full h-full'):
 
-            ui.button('Detail corpus', on_click=partial(ui.navigate.to, f'/corpus/{corpus_id}'))
-
-            table = ui.table(
+            with ui.row().classes('w-full items-center'):
+                ui.button('Detail corpus', on_click=partial(ui.navigate.to, f'/corpus/{corpus_id}'))
+                top_input = ui.number('Top', value=top, min=1, precision=0).classes('w-24')
+                min_frequency_input = ui.number('Min. frequency', value=min_frequency, min=1, precision=0).classes('w-32')
+                ui.button(
+                    'Apply',
+                    on_click=lambda: ui.navigate.to(
+                        f'/ngram/{corpus_id}/{min_len}/{max_len}/{case_sensitive}?top={int(top_input.value or top)}&min_frequency={int(min_frequency_input.value or min_frequency)}'
+                    ),
+                )
+
+            ui.label(
+                f'Showing the {len(ngrams.items)} most frequent of {ngrams.above_threshold} n-grams '
+                f'with frequency >= {min_frequency} ({ngrams.distinct} distinct n-grams)'
+            )
+
+            table = (await tables.make_server_side_table(
                 [
                     {'name': 'ngram', 'label': 'N-gram', 'field': 'ngram', 'sortable': True},
                     {'name': 'frequency', 'label': 'Frequency', 'field': 'frequency', 'sortable': True},
                 ],
-                sorted(
-                    [{'ngram': i[0], 'frequency': i[1]} for i in ngrams.items()],
-                    key=lambda i: (i['frequency'], i['ngram']),
-                    reverse=True
-                ),
+                ngrams.fetch_page,
                 #title=f'N-grams ({min_len-1} < N < {max_len+1}): {name}',
                 title=f'N-grams: {name}',
-                pagination=10,
-            ).classes('w-full')
+                row_key='ngram',
+                sort_by='frequency',
+                descending=True,
+            )).classes('w-full')
 
-            with table.add_slot('top-right'):
-                table.bind_filter(ui.input('Filter'), 'value')
+            with table.add_slot('top-right'), ui.row().classes('items-center no-wrap'):
+                tables.filter_input(table)
+                tables.export_button(table, ngrams, f'ngrams_{corpus_id}_{min_len}_{max_len}')
 
 @ui.page('/regex_window/{corpus_id:int}/{regex}/{case_sensitive}/{left_window_size:int}/{right_window_size:int}')
-def regex_window(corpus_id, regex, case_sensitive, left_window_size, right_window_size):
+async def regex_window(corpus_id, regex, case_sensitive, left_window_size, right_window_size):
     util.make_header_and_menu()
 
-    name, matches = util.api_request('get', f'/regex_window/{corpus_id}/{regex}/{case_sensitive}/{left_window_size}/{right_window_size}').json()
+    if (error := regex_error(regex)) is not None:
+        return show_regex_error(corpus_id, regex, error)
+
+    # the same value in the cache key and in the request, so differently spelled URLs cannot share a wrong result
+    await render_regex(corpus_id, regex, case_sensitive.lower() == 'true', left_window_size, right_window_size)
+
+async def show_regex_window(corpus_id, regex, result):
+    name, matches = result
+    matches = tables.FrequencyTable(matches, 'match')
 
     with ui.card().classes('w-2/3 h-5/6 absolute-center items-center no-shadow'):
         with ui.scroll_area().classes('w-full h-full'):
 
             ui.button('Detail corpus', on_click=partial(ui.navigate.to, f'/corpus/{corpus_id}'))
 
-            table = ui.table(
+            table = (await tables.make_server_side_table(
                 [
                     {'name': 'match', 'label': 'Match', 'field': 'match', 'sortable': True},
                     {'name': 'frequency', 'label': 'Frequency', 'field': 'frequency', 'sortable': True},
                 ],
-                sorted(
-                    [{'match': i[0], 'frequency': i[1]} for i in matches.items()],
-                    key=lambda i: (i['frequency'], i['match']),
-                    reverse=True
-                ),
+                matches.fetch_page,
                 title=f'Regex matching (window): {name}, {regex}',
-                pagination=10,
-            ).classes('w-full').props('wrap-cells')
+                row_key='match',
+                sort_by='frequency',
+                descending=True,
+            )).classes('w-full').props('wrap-cells')
 
-            with table.add_slot('top-right'):
-                table.bind_filter(ui.input('Filter'), 'value')
+            with table.add_slot('top-right'), ui.row().classes('items-center no-wrap'):
+                tables.filter_input(table)
+                tables.export_button(table, matches, f'regex_window_{corpus_id}')
 
             #for i, phrase in enumerate(phrases):
             #    with ui.teleport(f'#c{table.id} tr:nth-child({i+1}) td:nth-child(3)'):
             #        ui.html(f'<b>{phrase}</b>')
 
 @ui.page('/regex_phrases/{corpus_id:int}/{regex}/{case_sensitive}')
-def regex_phrases(corpus_id, regex, case_sensitive):
+async def regex_phrases(corpus_id, regex, case_sensitive):
     util.make_header_and_menu()
 
-    name, matches = util.api_request('get', f'/regex_phrases/{corpus_id}/{regex}/{case_sensitive}').json()
+    if (error := regex_error(regex)) is not None:
+        return show_regex_error(corpus_id, regex, error)
+
+    await render_regex(corpus_id, regex, case_sensitive.lower() == 'true')
+
+async def show_regex_phrases(corpus_id, regex, result):
+    name, matches = result
+    matches = tables.PagedRows([{'position': j, 'phrase': i, 'length': len(i)} for j, i in enumerate(matches, 1)], ['phrase'])
 
     with ui.card().classes('w-2/3 h-5/6 absolute-center items-center no-shadow'):
         with ui.scroll_area().classes('w-full h-full'):
 
             ui.button('Detail corpus', on_click=partial(ui.navigate.to, f'/corpus/{corpus_id}'))
 
-            table = ui.table(
+            table = (await tables.make_server_side_table(
                 [
                     {'name': 'position', 'label': 'Position', 'field': 'position', 'sortable': True},
                     {'name': 'length',   'label': 'Length',   'field': 'length',   'sortable': True},
                     {'name': 'phrase',   'label': 'Phrase',   'field': 'phrase',   'sortable': True, 'align': 'left'},
                 ],
-                [{'position': j, 'phrase': i, 'length': len(i)} for j, i in enumerate(matches, 1)],
+                matches.fetch_page,
                 title=f'Regex matching (phrases): {name}, {regex}',
-                pagination=10,
-            ).classes('w-full').props('wrap-cells')
+                row_key='position',
+            )).classes('w-full').props('wrap-cells')
 
-            with table.add_slot('top-right'):
-                table.bind_filter(ui.input('Filter'), 'value')
+            with table.add_slot('top-right'), ui.row().classes('items-center no-wrap'):
+                tables.filter_input(table)
+                tables.export_button(table, matches, f'regex_phrases_{corpus_id}')
 
             #for i, phrase in enumerate(phrases):
             #    with ui.teleport(f'#c{table.id} tr:nth-child({i+1}) td:nth-child(3)'):
@@ -1,21 +1,68 @@
 from functools import partial
-from nicegui import ui, events
+from fastapi import Response
+from nicegui import app, background_tasks, ui, events
+import tables
 import util
-import base64
+import asyncio, base64, httpx, json, math, os, re, tempfile, urllib.parse, zipfile
+
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 1024 * 1024 * 10))
+UPLOAD_CHUNK_SIZE = 3 * 64 * 1024  # a multiple of 3, so every chunk base64-encodes on its own
+MAX_ARCHIVE_SIZE = int(os.getenv('MAX_ARCHIVE_SIZE', 1024 * 1024 * 1024))
+BULK_UPLOAD_WORKERS = int(os.getenv('BULK_UPLOAD_WORKERS', 4))
+BULK_UPLOAD_RETRIES = int(os.getenv('BULK_UPLOAD_RETRIES', 3))
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
 
 ui.page('/document')(util.make_generic_list_entity_page('document'))
 
-def try_create_document(name, input_file):
-    r = util.api_request('post', 'document', name=name, input_file=input_file)
+async def send_document(name, input_file, on_progress=None, headers=None) -> httpx.Response:
+    # the same JSON body the backend always got, streamed from the spooled upload instead of built in memory
+    size = input_file.seek(0, os.SEEK_END)
+    input_file.seek(0)
+    head = ('{"name": ' + json.dumps(name) + ', "input_file": "').encode()
+    tail = b'"}'
+
+    async def body():
+        yield head
+        sent = 0
+        while chunk := input_file.read(UPLOAD_CHUNK_SIZE):
+            yield base64.b64encode(chunk)
+            sent += len(chunk)
+            if on_progress is not None:
+                on_progress(sent / size)
+        yield tail
+
+    headers = (headers or util.auth_headers()) | {
+        'Content-Type': 'application/json',
+        'Content-Length': str(len(head) + 4 * math.ceil(size / 3) + len(tail)),
+    }
+    return await util.send_request('post', 'document', headers=headers, content=body())
+
+async def upload_document(name, input_file, on_progress=None):
+    return util.check_response(await send_document(name, input_file, on_progress))
+
+async def try_create_document(name, input_file, progress):
+    r = await upload_document(name, input_file, progress.set_value)
 
     if r.status_code == 201:
+        util.mark_totals_stale()
         ui.navigate.to(f'/document/{r.json()["id"]}')
-    else:
-        util.notify_error(r)
 
-def handle_upload(e: events.UploadEventArguments):
-    try_create_document(e.name, base64.b64encode(e.content.read()).decode('utf8'))
-    e.sender.reset()
+def too_large(name):
+    return f'{name} is larger than {MAX_UPLOAD_SIZE // (1024 * 1024)} MB'
+
+async def handle_upload(progress, e: events.UploadEventArguments):
+    if e.content.seek(0, os.SEEK_END) > MAX_UPLOAD_SIZE:
+        ui.notify(f'Operation failed: {too_large(e.name)}', color='negative')
+        e.sender.reset()
+        return
+
+    progress.set_value(0)
+    progress.set_visibility(True)
+    try:
+        await try_create_document(e.name, e.content, progress)
+    finally:
+        progress.set_visibility(False)
+        e.sender.reset()
 
 @ui.page('/new_document')
 def create_document() -> None:
@@ -23,11 +70,198 @@ def create_document() -> None:
     with ui.card().classes('w-1/2 h-5/6 absolute-center items-center no-shadow'):
         with ui.scroll_area().classes('w-full h-full'):
             ui.label('New document').style('font-size: 150%')
-            ui.upload(label='Input file', auto_upload=True, on_upload=handle_upload).classes('w-full')
+            progress = ui.linear_progress(value=0, show_value=False).classes('w-full')
+            progress.set_visibility(False)
+            ui.upload(
+                label='Input file',
+                auto_upload=True,
+                max_file_size=MAX_UPLOAD_SIZE,
+                on_upload=partial(handle_upload, progress),
+            ).classes('w-full')
             #ui.label('Supported file types/extensions:')
             #for i in content_extractors:
             #    ui.label(i)
 
+async def with_retries(send):
+    # transient failures (lost connections, timeouts, overloaded backend) are retried with exponential backoff
+    for attempt in range(BULK_UPLOAD_RETRIES + 1):
+        try:
+            response = await send()
+            if response.status_code not in RETRY_STATUSES or attempt == BULK_UPLOAD_RETRIES:
+                return response
+        except httpx.TransportError:
+            if attempt == BULK_UPLOAD_RETRIES:
+                raise
+        await asyncio.sleep(2 ** attempt)
+
+def extract_member(archive, info):
+    # archive members are copied out once, so retries and the size lookup of send_document can seek freely;
+    # the size in the member's header can be forged, so the copy also stops at MAX_UPLOAD_SIZE
+    name = os.path.basename(info.filename)
+    if info.file_size > MAX_UPLOAD_SIZE:
+        raise ValueError(too_large(name))
+
+    output = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    with archive.open(info) as member:
+        while chunk := member.read(UPLOAD_CHUNK_SIZE):
+            if output.tell() + len(chunk) > MAX_UPLOAD_SIZE:
+                output.close()
+                raise ValueError(too_large(name))
+            output.write(chunk)
+    return output
+
+@ui.page('/bulk_documents')
+async def bulk_create_documents() -> None:
+    util.make_header_and_menu()
+
+    headers = util.auth_headers()
+    queue = asyncio.Queue()
+    workers = set()
+    rows = tables.PagedRows([], ['name'])
+    counts = {'queued': 0, 'done': 0, 'failed': 0}
+    changed = False
+    corpora = await util.entity_options('corpus')
+
+    def set_status(row, status, **details):
+        nonlocal changed
+        row.update(status=status, **details)
+        changed = True
+
+    async def process(row, open_file, corpus_id):
+        set_status(row, 'uploading')
+        input_file = None
+        try:
+            input_file = await open_file()
+            r = await with_retries(partial(send_document, row['name'], input_file, None, headers))
+            if r.status_code != 201:
+                return set_status(row, 'failed', error=util.error_message(r))
+            row['document'] = r.json()['id']
+
+            if corpus_id is not None:
+                set_status(row, 'linking')
+                endpoint = f'corpus/{corpus_id}/document/{row["document"]}'
+                r = await with_retries(partial(util.send_request, 'post', endpoint, headers=headers, json={}))
+                if r.status_code // 100 != 2:
+                    return set_status(row, 'failed', error=f'uploaded, but not linked: {util.error_message(r)}')
+                util.invalidate_corpus_results(endpoint)
+
+            set_status(row, 'done')
+        except Exception as e:
+            # a corrupt archive member fails only its own row, never the worker
+            set_status(row, 'failed', error=str(e) or type(e).__name__)
+        finally:
+            if input_file is not None:
+                input_file.close()
+            counts['done' if row['status'] == 'done' else 'failed'] += 1
+
+    async def worker():
+        # workers leave once the queue is empty, and new uploads start new ones
+        while not queue.empty():
+            await process(*queue.get_nowait())
+        workers.discard(asyncio.current_task())
+
+    def add_row(name):
+        nonlocal changed
+        row = {'row': len(rows.rows) + 1, 'name': name, 'status': 'queued', 'document': None, 'error': ''}
+        rows.rows.append(row)
+        rows.index = None
+        counts['queued'] += 1
+        changed = True
+        return row
+
+    def enqueue(name, open_file):
+        queue.put_nowait((add_row(name), open_file, corpus.value))
+
+    def fail(name, error):
+        set_status(add_row(name), 'failed', error=error)
+        counts['failed'] += 1
+
+    async def opened(input_file):
+        return input_file
+
+    def handle_upload(e: events.UploadEventArguments):
+        # uploads are only queued here; the worker pool sends them as fast as the backend accepts them
+        if e.name.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(e.content)
+            except zipfile.BadZipFile as error:
+                return fail(e.name, str(error))
+            members = [i for i in archive.infolist() if not i.is_dir()]
+            remaining = len(members)
+            if not remaining:
+                archive.close()
+
+            async def open_member(info):
+                # the archive outlives this handler, since the workers extract its members later; the last one closes it
+                nonlocal remaining
+                try:
+                    return await asyncio.to_thread(extract_member, archive, info)
+                finally:
+                    remaining -= 1
+                    if not remaining:
+                        archive.close()
+
+            for info in members:
+                enqueue(os.path.basename(info.filename), partial(open_member, info))
+        elif e.content.seek(0, os.SEEK_END) > MAX_UPLOAD_SIZE:
+            # the browser lets files up to MAX_ARCHIVE_SIZE through, which is only meant for archives
+            return fail(e.name, too_large(e.name))
+        else:
+            if queue.qsize() > BULK_UPLOAD_WORKERS and hasattr(e.content, 'rollover'):
+                e.content.rollover()  # files waiting in the queue are kept on disk instead of in memory
+            enqueue(e.name, partial(opened, e.content))
+
+        while len(workers) < min(BULK_UPLOAD_WORKERS, queue.qsize()):
+            workers.add(background_tasks.create(worker(), name='bulk upload'))
+
+    with ui.card().classes('w-2/3 h-5/6 absolute-center items-center no-shadow'):
+        with ui.scroll_area().classes('w-full h-full'):
+            ui.label('Bulk upload').style('font-size: 150%')
+            corpus = ui.select({None: 'No corpus'} | {i: j for i, j in corpora.items() if i is not None}, value=None, label='Link new documents to corpus', with_input=True)
+            uploader = ui.upload(
+                label='Input files or zip archives',
+                multiple=True,
+                auto_upload=True,
+                max_file_size=MAX_ARCHIVE_SIZE,
+                on_upload=handle_upload,
+            ).classes('w-full')
+            # cleared only when the whole batch is done; resetting earlier would abort the uploads still in flight
+            uploader.on('finished', lambda: uploader.run_method('removeUploadedFiles'))
+            summary = ui.label()
+            progress = ui.linear_progress(value=0, show_value=False).classes('w-full')
+
+            table = (await tables.make_server_side_table(
+                [
+                    {'name': 'row', 'label': '#', 'field': 'row', 'sortable': True},
+                    {'name': 'name', 'label': 'File', 'field': 'name', 'sortable': True, 'align': 'left'},
+                    {'name': 'status', 'label': 'Status', 'field': 'status', 'sortable': True},
+                    {'name': 'document', 'label': 'Document', 'field': 'document'},
+                    {'name': 'error', 'label': 'Error', 'field': 'error', 'align': 'left'},
+                ],
+                rows.fetch_page,
+                title='Files',
+                row_key='row',
+            )).classes('w-full').props('wrap-cells')
+            table.on('rowClick', lambda e: e.args[1]['document'] and ui.navigate.to(f'/document/{e.args[1]["document"]}'))
+
+            with table.add_slot('top-right'):
+                tables.filter_input(table)
+
+    async def refresh():
+        nonlocal changed
+        if not changed:
+            return
+        changed = False
+        finished = counts['done'] + counts['failed']
+        summary.set_text(f'{finished} of {counts["queued"]} files processed, {counts["failed"]} failed')
+        progress.set_value(finished / counts['queued'])
+        await table.reload()
+        if finished == counts['queued']:
+            util.invalidate_lookups('document')
+            util.mark_totals_stale()
+
+    ui.timer(1.0, refresh)
+
 def make_menu_document_detailing(document_id):
     ui.menu_item('Dictionary', partial(ui.navigate.to, f'/dictionary/{document_id}'))
     ui.menu_item('Phrasing', partial(ui.navigate.to, f'/phrasing/{document_id}'))
@@ -38,19 +272,19 @@ ui.page('/document/{entity_id}')(util.make_generic_detail_entity_page(
         'name': {'input_type': 'input'},
         'language_id': {
             'input_type': 'select',
-            'options_maker': lambda: {None: 'Undefined'} | {i['id']:i['name'] for i in util.api_request('get', 'language').json()},
+            'options_maker': partial(util.entity_options, 'language'),
             'input_kwargs': {'label': 'Language'},
             'entity': 'language',
         },
         'source_id': {
             'input_type': 'select',
-            'options_maker': lambda: {None: 'Undefined'} | {i['id']:i['name'] for i in util.api_request('get', 'organization').json()},
+            'options_maker': partial(util.entity_options, 'organization'),
             'input_kwargs': {'label': 'Source'},
             'entity': 'organization',
         },
         'publisher_id': {
             'input_type': 'select',
-            'options_maker': lambda: {None: 'Undefined'} | {i['id']:i['name'] for i in util.api_request('get', 'organization').json()},
+            'options_maker': partial(util.entity_options, 'organization'),
             'input_kwargs': {'label': 'Publisher'},
             'entity': 'organization',
         },
@@ -64,7 +298,7 @@ ui.page('/document/{entity_id}')(util.make_generic_detail_entity_page(
             'entity': 'author',
             'link_endpoint': 'author/{selected_id}/document/{reference_id}',
         },
-        'content': {'input_type': 'textarea'},
+        'content': {'input_type': 'lazy_textarea'},
         'citation': {'input_type': 'textarea'},
         #'users': {'input_type': 'table', 'entity': ''},
     },
@@ -72,66 +306,97 @@ ui.page('/document/{entity_id}')(util.make_generic_detail_entity_page(
 ))
 
 @ui.page('/phrasing/{document_id}')
-def dictionary(document_id):
+async def dictionary(document_id):
     util.make_header_and_menu()
-    name, phrases = util.api_request('get', f'phrasing/{document_id}').json()
+    result = await util.request_analysis(f'phrasing/{document_id}')
+    if result is None:
+        return
+    name, phrases = result
+    phrases = tables.PagedRows([{'position': j, 'phrase': i, 'length': len(i)} for j, i in enumerate(phrases, 1)], ['phrase'])
 
     with ui.card().classes('w-1/2 h-5/6 absolute-center items-center no-shadow'):
         with ui.scroll_area().classes('w-full h-full'):
 
             ui.button('Detail document', on_click=partial(ui.navigate.to, f'/document/{document_id}'))
 
-            table = ui.table(
+            table = (await tables.make_server_side_table(
                 [
                     {'name': 'position', 'label': 'Position', 'field': 'position', 'sortable': True},
                     {'name': 'length',   'label': 'Length',   'field': 'length',   'sortable': True},
                     {'name': 'phrase',   'label': 'Phrase',   'field': 'phrase',   'sortable': True, 'align': 'left'},
                 ],
-                [{'position': j, 'phrase': i, 'length': len(i)} for j, i in enumerate(phrases, 1)],
+                phrases.fetch_page,
                 title=f'Phrasing: {name}',
-                pagination=10,
-            ).classes('w-full').props('wrap-cells')
+                row_key='position',
+            )).classes('w-full').props('wrap-cells')
 
-            with table.add_slot('top-right'):
-                table.bind_filter(ui.input('Filter'), 'value')
+            with table.add_slot('top-right'), ui.row().classes('items-center no-wrap'):
+                tables.filter_input(table)
+                tables.export_button(table, phrases, f'phrasing_{document_id}')
 
 @ui.page('/dictionary/{document_id}')
-def dictionary(document_id):
+async def dictionary(document_id):
     util.make_header_and_menu()
-    name, dictionary = util.api_request('get', f'dictionary/{document_id}').json()
+    result = await util.request_analysis(f'dictionary/{document_id}')
+    if result is None:
+        return
+    name, dictionary = result
+    dictionary = tables.FrequencyTable(dictionary, 'term')
 
     with ui.card().classes('w-1/2 h-5/6 absolute-center items-center no-shadow'):
         with ui.scroll_area().classes('w-full h-full'):
 
             ui.button('Detail document', on_click=partial(ui.navigate.to, f'/document/{document_id}'))
 
-            table = ui.table(
+            table = (await tables.make_server_side_table(
                 [
                     {'name': 'term', 'label': 'Term', 'field': 'term', 'sortable': True},
                     {'name': 'frequency', 'label': 'Frequency', 'field': 'frequency', 'sortable': True},
                 ],
-                sorted(
-                    [{'term': i[0], 'frequency': i[1]} for i in dictionary.items()],
-                    key=lambda i: (i['frequency'], i['term']),
-                    reverse=True
-                ),
+                dictionary.fetch_page,
                 title=f'Dictionary: {name}',
-                pagination=10,
-            ).classes('w-full')
+                row_key='term',
+                sort_by='frequency',
+                descending=True,
+            )).classes('w-full')
 
-            with table.add_slot('top-right'):
-                table.bind_filter(ui.input('Filter'), 'value')
+            with table.add_slot('top-right'), ui.row().classes('items-center no-wrap'):
+                tables.filter_input(table)
+                tables.export_button(table, dictionary, f'dictionary_{document_id}')
+
+def content_disposition(filename: str) -> str:
+    # the UTF-8 name for browsers that read filename*, and a plain ASCII one for those that do not
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', '_', filename)
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{urllib.parse.quote(filename, safe="")}'
+
+@app.get('/download/document/{document_id}')
+async def download_input_file(document_id: int) -> Response:
+    # fetched per download, so pages never keep the input file around
+    r = await util.send_request('get', f'document/{document_id}', headers=util.auth_headers(), json={})
+    if r.status_code != 200:
+        return Response(r.content, status_code=r.status_code, media_type=r.headers.get('content-type'))
+
+    document = r.json()
+    return Response(
+        base64.b64decode(document['input_file']),
+        media_type='application/octet-stream',
+        headers={'Content-Disposition': content_disposition(document['name'])},
+    )
 
 @ui.page('/document2/{document_id}')
-def manage_document(document_id):
+async def manage_document(document_id):
 
     inputs = ['name']
     textareas = ['citation', 'content']
     selects = ['language']
 
     @ui.refreshable
-    def render_page():
-        document = util.api_request('get', f'document/{document_id}').json()
+    async def render_page():
+        response = await util.api_request('get', f'document/{document_id}?exclude=input_file')
+        if response.status_code != 200:
+            return
+        document = response.json()
+        document.pop('input_file', None)
         #print(list(document.keys()))
         #print(document['language'])
 
@@ -140,7 +405,7 @@ def manage_document(document_id):
                 #ui.label(f'Document: {document["name"]}').style('font-size: 150%')
                 ui.label(f'Document detail').style('font-size: 150%')
 
-                ui.button('Download input file', on_click=lambda: ui.download(base64.b64decode(document['input_file'].encode('utf-8')), document['name']))
+                ui.button('Download input file', on_click=lambda: ui.download(f'/download/document/{document_id}'))
 
                 for i in inputs:
                     ui.input(i.title(), value=document[i]).classes('w-full')
@@ -151,9 +416,9 @@ def manage_document(document_id):
                 for i in textareas:
                     ui.textarea(i.title(), value=document[i]).classes('w-full')
 
-                util.make_users_tbl(document['users'], 'document', document_id, render_page)
+                await util.make_users_tbl(document['users'], 'document', document_id, render_page)
 
-                util.make_docs_corpora_tbl('Corpora', 'corpus', document['corpora'], document_id, render_page)
+                await util.make_docs_corpora_tbl('Corpora', 'corpus', document['corpora'], document_id, render_page)
 
-    render_page()
+    await render_page()
     util.make_header_and_menu()
\ No newline at end of file
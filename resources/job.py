@@ -0,0 +1,89 @@
+import time
+from functools import partial
+from nicegui import ui
+import jobs
+import util
+
+JOB_POLL_INTERVAL = 1.0
+
+def job_rows():
+    return [
+        {
+            'id': i.id,
+            'title': i.title,
+            'status': i.status,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(i.started)),
+            'elapsed': f'{i.elapsed:.0f} s',
+        }
+        for i in jobs.user_jobs(util.user_scope())
+    ]
+
+@ui.page('/jobs')
+def list_jobs():
+    util.make_header_and_menu()
+
+    with ui.card().classes('w-2/3 absolute-center items-center'):
+        table = ui.table(
+            [
+                {'name': 'title', 'label': 'Analysis', 'field': 'title', 'align': 'left'},
+                {'name': 'status', 'label': 'Status', 'field': 'status'},
+                {'name': 'started', 'label': 'Started', 'field': 'started'},
+                {'name': 'elapsed', 'label': 'Duration', 'field': 'elapsed'},
+            ],
+            job_rows(),
+            title='Analyses',
+            row_key='id',
+        ).classes('w-full')
+        table.on('rowClick', lambda e: ui.navigate.to(f'/job/{e.args[1]["id"]}'))
+
+    def refresh_rows():
+        table.rows = job_rows()
+        table.update()
+
+    ui.timer(JOB_POLL_INTERVAL, refresh_rows)
+
+def show_progress(job):
+    with ui.card().classes('absolute-center items-center'):
+        ui.label(job.title)
+        if job.status == 'running':
+            ui.spinner(size='lg')
+            elapsed = ui.label(f'Running for {job.elapsed:.0f} s')
+        else:
+            ui.label(f'Failed after {job.elapsed:.0f} s: {job.error}').classes('text-negative')
+            elapsed = None
+        ui.button('Analyses', on_click=partial(ui.navigate.to, '/jobs'))
+    return elapsed
+
+@ui.page('/job/{job_id}')
+async def view_job(job_id):
+    util.make_header_and_menu()
+
+    job = jobs.jobs.get(job_id)
+    if job is None or job.owner != util.user_scope():
+        with ui.card().classes('absolute-center items-center'):
+            ui.label('This analysis does not exist or has expired')
+            ui.button('Analyses', on_click=partial(ui.navigate.to, '/jobs'))
+        return
+
+    if job.status == 'done':
+        return await job.render(job.result)
+
+    # the page is served right away and swaps the progress for the result when the job finishes
+    container = ui.element('div')
+    with container:
+        elapsed = show_progress(job)
+
+    async def poll():
+        if job.status == 'running':
+            elapsed.set_text(f'Running for {job.elapsed:.0f} s')
+            return
+
+        timer.deactivate()
+        container.clear()
+        with container:
+            if job.status == 'done':
+                await job.render(job.result)
+            else:
+                show_progress(job)
+
+    timer = ui.timer(JOB_POLL_INTERVAL, poll)
@@ -1,38 +1,55 @@
 from typing import Optional
 from util import notify_error, input_required
-from util import api_request
+from util import api_request, expire_session, store_session, token_valid
 from fastapi.responses import RedirectResponse
 from nicegui import Client, app, ui
 import os
-import requests
+import re
+import httpx
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.routing import compile_path
 from fastapi import Request
 
 HCAPTCHA_SITEKEY = os.getenv("HCAPTCHA_SITEKEY")
 HCAPTCHA_SECRETKEY = os.getenv("HCAPTCHA_SECRETKEY"),
 
-unrestricted_page_routes = {'/login'}
+unrestricted_page_routes = {'/login', '/metrics'}
+
+# plain routes that are not pages but still need a logged in user
+restricted_api_routes = {'/download/document/{document_id}'}
+
+# one alternation of every restricted page route, built at startup so parametrized routes like /corpus/{entity_id} match too
+restricted_page_pattern: re.Pattern | None = None
+
+def build_route_index() -> None:
+    global restricted_page_pattern
+    patterns = [
+        re.sub(r'\(\?P<\w+>', '(?:', compile_path(i)[0].pattern)[1:-1]  # drop the group names and the ^$ anchors
+        for i in (set(Client.page_routes.values()) | restricted_api_routes) - unrestricted_page_routes
+    ]
+    restricted_page_pattern = re.compile('|'.join(f'(?:{i})' for i in patterns) or '(?!)')
+
+app.on_startup(build_route_index)
 
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        #print('-'*10)
-        #print(app.storage.user)
-        #print(request.url.path)
-        #print(Client.page_routes)
-        #print('-'*10)
-        if not app.storage.user.get('access_token', False):
-            if request.url.path not in unrestricted_page_routes and request.url.path in Client.page_routes.values():
-                app.storage.user['referrer_path'] = request.url.path  # remember where the user wanted to go
-                return RedirectResponse('/login')
+        path = request.url.path
+        if path.startswith('/_nicegui/') or not restricted_page_pattern.fullmatch(path):
+            return await call_next(request)
+
+        if not app.storage.user.get('access_token', False) or not token_valid():
+            expire_session()
+            app.storage.user['referrer_path'] = path  # remember where the user wanted to go
+            return RedirectResponse('/login')
         return await call_next(request)
 
 
 async def try_login(email, password, client) -> None:
     if True:  #await check_captcha(client):
-        r = api_request('post', 'login', email=email.value, password=password.value)
+        r = await api_request('post', 'login', email=email.value, password=password.value)
 
         if r.status_code == 200:
-            app.storage.user.update({'email': email.value, **r.json()})
+            store_session({'email': email.value, **r.json()})
             ui.navigate.to(app.storage.user.get('referrer_path', '/'))  # go back to where the user wanted to go
         else:
             notify_error(r)
@@ -41,7 +58,7 @@ async def try_login(email, password, client) -> None:
 
 async def try_register(name, email, client: Client) -> None:
     if True:  #await check_captcha(client):
-        r = api_request('post', 'register', name=name.value, email=email.value, access_level=2)
+        r = await api_request('post', 'register', name=name.value, email=email.value, access_level=2)
 
         if r.status_code == 201:
             ui.notify(f'User successfully registered', color='positive')
@@ -61,7 +78,8 @@ async def check_captcha(client: Client) -> bool:
         "remoteip": ip,
         "sitekey": HCAPTCHA_SITEKEY
     }
-    res = requests.post(url="https://api.hcaptcha.com/siteverify", data=payload)
+    async with httpx.AsyncClient() as captcha_client:
+        res = await captcha_client.post(url="https://api.hcaptcha.com/siteverify", data=payload)
     try:
         res = res.json()
         if res.get("success", False):
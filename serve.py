@@ -0,0 +1,43 @@
+import os
+import signal
+import subprocess
+import sys
+
+# runs WORKERS copies of main.py on consecutive ports for a reverse proxy to balance, see deploy/nginx.conf
+WORKERS = int(os.getenv('WORKERS', os.cpu_count() or 1))
+PORT = int(os.getenv('PORT', 8081))
+STORAGE_PATH = os.getenv('NICEGUI_STORAGE_PATH', '.nicegui')
+SESSION_STORE = os.getenv('SESSION_STORE', f'sqlite:///{os.path.abspath(STORAGE_PATH)}/sessions.db')
+
+
+def main() -> None:
+    if not os.getenv('NICEGUI_STORAGE_SECRET_KEY'):
+        sys.exit('NICEGUI_STORAGE_SECRET_KEY must be set, so every worker accepts the same session cookies')
+    os.makedirs(STORAGE_PATH, exist_ok=True)
+
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    workers = [
+        subprocess.Popen(
+            [sys.executable, main_py],
+            env=os.environ | {'PORT': str(PORT + i), 'RELOAD': '0', 'SESSION_STORE': SESSION_STORE},
+        )
+        for i in range(WORKERS)
+    ]
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # one worker dying takes the others down too, so a supervisor (docker, systemd) can restart the whole set
+    os.wait()
+    stop(None, None)
+    for worker in workers:
+        worker.wait()
+    sys.exit(1 if any(i.returncode not in (0, -signal.SIGTERM) for i in workers) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import abc
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from nicegui import Client, background_tasks, json
+from nicegui.logging import log
+from nicegui.observables import ObservableDict
+from nicegui.storage import Storage, request_contextvar
+from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import Request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+SESSION_TTL = float(os.getenv('SESSION_TTL', 30 * 24 * 60 * 60))
+SESSION_SYNC_INTERVAL = float(os.getenv('SESSION_SYNC_INTERVAL', 1.0))
+SESSION_IDLE_TIME = float(os.getenv('SESSION_IDLE_TIME', 10 * 60))  # local copies unused for this long are dropped
+
+
+class SessionStore(abc.ABC):
+    # where user sessions live when several processes serve the app; versions only ever grow, so a
+    # process can tell whether its copy of a session is still current without loading it
+    @abc.abstractmethod
+    def load(self, session_id: str) -> tuple[dict, int]:
+        ...
+
+    @abc.abstractmethod
+    def versions(self, session_ids: list[str]) -> dict[str, int]:
+        ...
+
+    @abc.abstractmethod
+    def save(self, session_id: str, data: dict) -> int:
+        ...
+
+    def purge(self, max_age: float) -> None:
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    # one database file shared by every process on the machine, e.g. on a volume
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS session (id TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL, updated REAL NOT NULL)')
+
+    def connection(self) -> sqlite3.Connection:
+        # one connection per thread, since saves run in worker threads
+        if not hasattr(self.local, 'db'):
+            self.local.db = sqlite3.connect(self.path, timeout=10)
+            self.local.db.execute('PRAGMA journal_mode=WAL')
+            self.local.db.execute('PRAGMA synchronous=NORMAL')
+        return self.local.db
+
+    def load(self, session_id: str) -> tuple[dict, int]:
+        row = self.connection().execute('SELECT data, version FROM session WHERE id = ?', (session_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else ({}, 0)
+
+    def versions(self, session_ids: list[str]) -> dict[str, int]:
+        versions = {}
+        for start in range(0, len(session_ids), 500):  # below SQLite's limit of variables per statement
+            batch = session_ids[start:start + 500]
+            versions.update(self.connection().execute(
+                f'SELECT id, version FROM session WHERE id IN ({",".join("?" * len(batch))})', batch,
+            ).fetchall())
+        return {i: versions.get(i, 0) for i in session_ids}
+
+    def save(self, session_id: str, data: dict) -> int:
+        with self.connection() as db:
+            return db.execute(
+                'INSERT INTO session VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (id) DO UPDATE SET data = excluded.data, version = version + 1, updated = excluded.updated '
+                'RETURNING version',
+                (session_id, json.dumps(data), time.time()),
+            ).fetchone()[0]
+
+    def purge(self, max_age: float) -> None:
+        with self.connection() as db:
+            db.execute('DELETE FROM session WHERE updated < ?', (time.time() - max_age,))
+
+
+class RedisSessionStore(SessionStore):
+    # for workers on several machines; sessions expire in Redis itself
+    def __init__(self, url: str, prefix: str = 'corpografo:session:') -> None:
+        if redis is None:
+            raise RuntimeError('the redis package is needed for a redis:// SESSION_STORE')
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def load(self, session_id: str) -> tuple[dict, int]:
+        data, version = self.redis.hmget(self.prefix + session_id, 'data', 'version')
+        return (json.loads(data), int(version)) if data else ({}, 0)
+
+    def versions(self, session_ids: list[str]) -> dict[str, int]:
+        pipeline = self.redis.pipeline(transaction=False)
+        for i in session_ids:
+            pipeline.hget(self.prefix + i, 'version')
+        return {i: int(j or 0) for i, j in zip(session_ids, pipeline.execute())}
+
+    def save(self, session_id: str, data: dict) -> int:
+        key = self.prefix + session_id
+        pipeline = self.redis.pipeline()
+        pipeline.hset(key, 'data', json.dumps(data))
+        pipeline.hincrby(key, 'version', 1)
+        pipeline.expire(key, int(SESSION_TTL))
+        return pipeline.execute()[1]
+
+
+def open_store(url: str) -> SessionStore:
+    # sqlite:///relative/sessions.db, sqlite:////absolute/sessions.db or redis://host:port/db
+    scheme = urllib.parse.urlsplit(url).scheme
+    if scheme == 'sqlite':
+        return SQLiteSessionStore(url.removeprefix('sqlite:///'))
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisSessionStore(url)
+    raise ValueError(f'Unknown SESSION_STORE {url!r}')
+
+
+class SharedSession(ObservableDict):
+    # a process-local copy of one session; changes are written back in the background, one save at a time
+    def __init__(self, store: SessionStore, session_id: str, data: dict, version: int) -> None:
+        self.store = store
+        self.session_id = session_id
+        self.version = version
+        self.used = time.monotonic()
+        self.saving = False
+        super().__init__(data, on_change=self.backup)
+
+    def backup(self) -> None:
+        async def backup() -> None:
+            try:
+                self.version = await asyncio.to_thread(self.store.save, self.session_id, json.loads(json.dumps(self)))
+            finally:
+                self.saving = False
+        self.saving = True
+        background_tasks.create_lazy(backup(), name=f'session {self.session_id}')
+
+    def replace(self, data: dict, version: int) -> None:
+        # takes what another process saved, in place so dicts handed out before see it too, and without saving it back
+        dict.clear(self)
+        for key, value in data.items():
+            dict.__setitem__(self, key, self._observe(value))
+        self.version = version
+
+
+class SharedStorage(Storage):
+    # app.storage.user read from and written to a SessionStore, so any process can serve any user; the store is only
+    # ever waited on off the event loop, by SessionLoadingMiddleware and the periodic sync
+    def __init__(self, store: SessionStore) -> None:
+        super().__init__()
+        self.store = store
+        self.sessions: dict[str, SharedSession] = {}
+
+    async def load(self, session_id: str) -> None:
+        if session_id not in self.sessions:
+            data, version = await asyncio.to_thread(self.store.load, session_id)
+            if session_id not in self.sessions:
+                self.sessions[session_id] = SharedSession(self.store, session_id, data, version)
+
+    async def sync(self) -> None:
+        # reloads the sessions another process changed and drops the ones nobody used for a while
+        while True:
+            await asyncio.sleep(SESSION_SYNC_INTERVAL)
+            now = time.monotonic()
+            for client in Client.instances.values():
+                # copies used by a connected page are kept, so its event handlers never load them on the event loop
+                if client.has_socket_connection and client.request is not None:
+                    session = self.sessions.get(client.request.session.get('id'))
+                    if session is not None:
+                        session.used = now
+            for session_id, session in list(self.sessions.items()):
+                if not session.saving and now - session.used > SESSION_IDLE_TIME:
+                    del self.sessions[session_id]
+
+            checked = [i for i, j in self.sessions.items() if not j.saving]
+            if not checked:
+                continue
+            try:
+                versions = await asyncio.to_thread(self.store.versions, checked)
+                for session_id, version in versions.items():
+                    session = self.sessions.get(session_id)
+                    if session is not None and not session.saving and version > session.version:
+                        data, version = await asyncio.to_thread(self.store.load, session_id)
+                        if not session.saving and version > session.version:
+                            session.replace(data, version)
+            except Exception:
+                log.exception('Could not sync sessions')
+
+    @property
+    def user(self) -> SharedSession:
+        request = request_contextvar.get()
+        if request is None:
+            return super().user  # raises the same errors as NiceGUI's own storage
+
+        session_id = request.session['id']
+        session = self.sessions.get(session_id)
+        if session is None:
+            # requests have it loaded by the middleware and connected pages keep it, so this is only a page whose
+            # connection was gone for longer than SESSION_IDLE_TIME
+            session = self.sessions[session_id] = SharedSession(self.store, session_id, *self.store.load(session_id))
+        session.used = time.monotonic()
+        return session
+
+
+class SessionLoadingMiddleware(BaseHTTPMiddleware):
+    # loads the session in a worker thread before anything in the request reads app.storage.user
+    def __init__(self, app, storage: SharedStorage) -> None:
+        super().__init__(app)
+        self.storage = storage
+
+    async def dispatch(self, request: Request, call_next):
+        await self.storage.load(request.session['id'])
+        return await call_next(request)
@@ -0,0 +1,375 @@
+import asyncio
+import csv
+import heapq
+import io
+import os
+import re
+import secrets
+import sys
+import weakref
+from array import array
+from bisect import bisect_left
+from functools import partial
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from nicegui import app, ui
+
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator, Sequence
+from typing import Any
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MAX_ROWS_PER_PAGE = 100
+FILTER_DEBOUNCE_MS = 300
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', 10_000))
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', 100_000))
+
+FetchPage = Callable[[int, int, str | None, bool, str], Awaitable[tuple[list[dict[str, Any]], int]]]
+
+WORD = re.compile(r'\w+')
+
+
+class RowIndex:
+    # sorted lowercase word tokens of every row, so a filter term is a binary search instead of a scan
+    def __init__(self, texts: Sequence[str]) -> None:
+        self.texts = texts
+        tokens = []
+        rows = array('i')
+        for row, text in enumerate(texts):
+            for token in set(WORD.findall(text.lower())):
+                tokens.append(sys.intern(token))
+                rows.append(row)
+
+        order = sorted(range(len(tokens)), key=tokens.__getitem__)
+        self.tokens = [tokens[i] for i in order]
+        self.rows = array('i', (rows[i] for i in order))
+
+    def search(self, query: str) -> list[int]:
+        # rows in which every query term starts a word; queries without word characters fall back to a substring scan
+        query = query.lower()
+        terms = WORD.findall(query)
+        if not terms:
+            return [i for i, text in enumerate(self.texts) if query in text.lower()]
+
+        matches = None
+        for term in terms:
+            start = bisect_left(self.tokens, term)
+            end = bisect_left(self.tokens, term + '\U0010ffff', start)
+            term_matches = set(self.rows[start:end])
+            matches = term_matches if matches is None else matches & term_matches
+
+        return sorted(matches)
+
+
+class PagedRows:
+    # rows kept on the server and cut into pages on request; the filter index is built on first use
+    def __init__(self, rows: list[dict[str, Any]], filter_fields: list[str] | None = None) -> None:
+        self.rows = rows
+        self.filter_fields = filter_fields
+        self.index = None
+
+    def add(self, *rows: dict[str, Any], key: str = 'id') -> None:
+        self.remove(*rows, key=key)
+        self.rows.extend(rows)
+
+    def remove(self, *rows: dict[str, Any], key: str = 'id') -> None:
+        keys = {i.get(key) for i in rows}
+        self.rows = [i for i in self.rows if i.get(key) not in keys]
+        self.index = None
+
+    def text(self, row: dict[str, Any]) -> str:
+        fields = self.filter_fields or row.keys()
+        return ' '.join(str(row.get(i, '')) for i in fields)
+
+    async def search(self, filter: str) -> list[dict[str, Any]]:
+        if self.index is None:
+            self.index = await asyncio.to_thread(RowIndex, [self.text(i) for i in self.rows])
+        return [self.rows[i] for i in self.index.search(filter)]
+
+    def iter_rows(self, fields: list[str]) -> Iterator[tuple]:
+        for row in self.rows:
+            yield tuple(row.get(i) for i in fields)
+
+    async def fetch_page(self, page: int, rows_per_page: int, sort_by: str | None, descending: bool, filter: str) -> tuple[list[dict[str, Any]], int]:
+        rows = await self.search(filter) if filter else self.rows
+
+        if sort_by:
+            rows = sorted(rows, key=lambda i: (i.get(sort_by) is None, i.get(sort_by)), reverse=descending)
+
+        start = (page - 1) * rows_per_page
+        return rows[start:start + rows_per_page], len(rows)
+
+
+Frequencies = dict[str, int] | tuple[Sequence[str], Sequence[int]]
+
+
+class FrequencyTable:
+    # keeps the `top` most frequent terms (all of them if `top` is None) at or above `min_frequency` as (frequency, term) pairs;
+    # frequencies map terms to counts or come as a (terms, frequencies) pair of columns, e.g. Arrow arrays
+    def __init__(self, frequencies: Frequencies, term_field: str, top: int | None = None, min_frequency: int = 1) -> None:
+        self.term_field = term_field
+        self.above_threshold = 0
+        self.index = None
+
+        if isinstance(frequencies, dict):
+            self.distinct = len(frequencies)
+            pairs = frequencies.items()
+        else:
+            terms, counts = frequencies
+            self.distinct = len(terms)
+            if pyarrow is not None and isinstance(counts, pyarrow.Array):
+                self.select_arrow(terms, counts, top, min_frequency)
+                return
+            pairs = zip(terms, counts)
+
+        def above_threshold():
+            for term, frequency in pairs:
+                if frequency >= min_frequency:
+                    self.above_threshold += 1
+                    yield frequency, term
+
+        if top is None:
+            self.items = sorted(above_threshold(), reverse=True)
+        else:
+            self.items = heapq.nlargest(top, above_threshold())
+
+    def select_arrow(self, terms, counts, top: int | None, min_frequency: int) -> None:
+        # filtered and ranked by Arrow, so only the kept terms ever become Python objects
+        table = pyarrow.table({'term': terms, 'frequency': counts})
+        table = table.filter(pyarrow.compute.greater_equal(table['frequency'], min_frequency))
+        self.above_threshold = table.num_rows
+
+        sort_keys = [('frequency', 'descending'), ('term', 'descending')]
+        if top is not None and top < table.num_rows:
+            table = table.take(pyarrow.compute.select_k_unstable(table, top, sort_keys))
+        table = table.take(pyarrow.compute.sort_indices(table, sort_keys))
+        self.items = list(zip(table['frequency'].to_pylist(), table['term'].to_pylist()))
+
+    async def search(self, filter: str) -> list[tuple[int, str]]:
+        if self.index is None:
+            self.index = await asyncio.to_thread(RowIndex, [i[1] for i in self.items])
+        return [self.items[i] for i in self.index.search(filter)]
+
+    def iter_rows(self, fields: list[str]) -> Iterator[tuple]:
+        positions = [1 if i == self.term_field else 0 for i in fields]
+        for item in self.items:
+            yield tuple(item[i] for i in positions)
+
+    async def fetch_page(self, page: int, rows_per_page: int, sort_by: str | None, descending: bool, filter: str) -> tuple[list[dict[str, Any]], int]:
+        items = await self.search(filter) if filter else self.items
+
+        if sort_by == self.term_field:
+            items = sorted(items, key=lambda i: i[1], reverse=descending)
+        elif sort_by == 'frequency' and not descending:
+            items = items[::-1]
+
+        start = (page - 1) * rows_per_page
+        return [{self.term_field: i[1], 'frequency': i[0]} for i in items[start:start + rows_per_page]], len(items)
+
+
+class ArrayRows:
+    # rows kept as equally long NumPy columns; sorting and filtering work on positions and only the visible page becomes dicts
+    def __init__(self, columns: dict[str, Any], filter_field: str) -> None:
+        self.columns = columns
+        self.filter_field = filter_field
+        self.index = None
+        self.orders = {}
+        self.filtered = (None, None)
+
+    async def search(self, filter: str) -> Any:
+        if self.index is None:
+            self.index = await asyncio.to_thread(RowIndex, self.columns[self.filter_field].tolist())
+        return numpy.array(await asyncio.to_thread(self.index.search, filter), dtype=numpy.intp)
+
+    async def positions(self, sort_by: str | None, filter: str) -> Any:
+        # the rows of the last (sort, filter) asked for are kept, so paging through them does not filter again
+        key, positions = self.filtered
+        if key != (sort_by, filter):
+            positions = await self.order(sort_by) if sort_by else numpy.arange(len(self.columns[self.filter_field]))
+            if filter:
+                positions = positions[await asyncio.to_thread(numpy.isin, positions, await self.search(filter))]
+            self.filtered = ((sort_by, filter), positions)
+        return positions
+
+    async def order(self, sort_by: str) -> Any:
+        if sort_by not in self.orders:
+            self.orders[sort_by] = await asyncio.to_thread(numpy.argsort, self.columns[sort_by], kind='stable')
+        return self.orders[sort_by]
+
+    def iter_rows(self, fields: list[str]) -> Iterator[tuple]:
+        # converted a chunk at a time, so an export never holds every column as Python objects at once
+        rows = len(self.columns[self.filter_field])
+        for start in range(0, rows, EXPORT_CHUNK_ROWS):
+            yield from zip(*(self.columns[i][start:start + EXPORT_CHUNK_ROWS].tolist() for i in fields))
+
+    async def fetch_page(self, page: int, rows_per_page: int, sort_by: str | None, descending: bool, filter: str) -> tuple[list[dict[str, Any]], int]:
+        positions = await self.positions(sort_by, filter)
+        if descending:
+            positions = positions[::-1]
+
+        start = (page - 1) * rows_per_page
+        page_positions = positions[start:start + rows_per_page]
+        names = list(self.columns)
+        return [dict(zip(names, i)) for i in zip(*(self.columns[j][page_positions].tolist() for j in names))], len(positions)
+
+
+def filter_input(table: ui.table) -> ui.input:
+    # the input only syncs after typing pauses, and the table then asks the server for the matching page
+    filter = ui.input('Filter').props(f'debounce={FILTER_DEBOUNCE_MS} clearable')
+    table.bind_filter(filter, 'value')
+    return filter
+
+
+# results that can be downloaded, only for as long as the page showing them is alive
+exports: weakref.WeakValueDictionary[str, PagedRows | FrequencyTable | ArrayRows] = weakref.WeakValueDictionary()
+export_details: dict[str, tuple[list[str], str]] = {}
+
+
+def register_export(source: PagedRows | FrequencyTable | ArrayRows, fields: list[str], filename: str) -> str:
+    export_id = secrets.token_urlsafe(16)
+    exports[export_id] = source
+    export_details[export_id] = (fields, filename)
+    weakref.finalize(source, export_details.pop, export_id, None)
+    return export_id
+
+
+async def csv_chunks(rows: Iterator[tuple], fields: list[str], delimiter: str) -> AsyncIterator[bytes]:
+    # written a chunk of rows at a time, yielding to the event loop in between
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    writer.writerow(fields)
+    while True:
+        writer.writerows(row for _, row in zip(range(EXPORT_CHUNK_ROWS), rows))
+        chunk = buffer.getvalue()
+        if not chunk:
+            return
+        yield chunk.encode()
+        buffer.seek(0)
+        buffer.truncate()
+        await asyncio.sleep(0)
+
+
+class ChunkSink(io.RawIOBase):
+    # collects what the Parquet writer produced since the last drain
+    def __init__(self) -> None:
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+async def parquet_chunks(rows: Iterator[tuple], fields: list[str]) -> AsyncIterator[bytes]:
+    # one row group per batch of rows, encoded in a worker thread
+    sink = ChunkSink()
+    writer = None
+    while True:
+        batch = list(zip(*(row for _, row in zip(range(EXPORT_BATCH_ROWS), rows))))
+        if not batch:
+            break
+        table = pyarrow.table(dict(zip(fields, batch)))
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        await asyncio.to_thread(writer.write_table, table)
+        yield sink.drain()
+
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', lambda rows, fields: csv_chunks(rows, fields, ',')),
+    'tsv': ('text/tab-separated-values', lambda rows, fields: csv_chunks(rows, fields, '\t')),
+    'parquet': ('application/vnd.apache.parquet', parquet_chunks),
+}
+
+
+@app.get('/export/{export_id}.{format}')
+def export(export_id: str, format: str) -> StreamingResponse:
+    source = exports.get(export_id)
+    if source is None or format not in EXPORT_FORMATS or (format == 'parquet' and pyarrow is None):
+        raise HTTPException(404)
+
+    fields, filename = export_details[export_id]
+    media_type, chunks = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        chunks(source.iter_rows(fields), fields),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{format}"'},
+    )
+
+
+def export_button(table: ui.table, source: PagedRows | FrequencyTable | ArrayRows, filename: str) -> ui.button:
+    export_id = register_export(source, [i['field'] for i in table.columns], re.sub(r'[^\w.-]+', '_', filename))
+    with ui.button('Export', icon='download').props('flat') as button:
+        with ui.menu():
+            for format in EXPORT_FORMATS:
+                if format != 'parquet' or pyarrow is not None:
+                    ui.menu_item(format.upper(), partial(ui.download, f'/export/{export_id}.{format}'))
+    return button
+
+
+class ServerSideTable(ui.table):
+    # only ever holds the visible page; Quasar asks for the others through the `request` event
+    def __init__(self, columns: list[dict[str, Any]], fetch_page: FetchPage, **kwargs: Any) -> None:
+        super().__init__(columns, [], **kwargs)
+        self.fetch_page = fetch_page
+        self.on('request', lambda event: self.load(event.args['pagination'], event.args.get('filter')))
+
+    async def load(self, pagination: dict[str, Any], filter: str | None) -> None:
+        rows_per_page = min(pagination.get('rowsPerPage') or MAX_ROWS_PER_PAGE, MAX_ROWS_PER_PAGE)
+        rows, total = await self.fetch_page(
+            pagination.get('page', 1),
+            rows_per_page,
+            pagination.get('sortBy'),
+            bool(pagination.get('descending')),
+            filter or '',
+        )
+        self.rows = rows
+        self.pagination = pagination | {'rowsPerPage': rows_per_page, 'rowsNumber': total}
+
+    async def reload(self) -> None:
+        # fetch the current page again, e.g. after rows were added to or removed from the source
+        await self.load(self.pagination, self._props.get('filter'))
+
+
+async def make_server_side_table(
+    columns: list[dict[str, Any]],
+    fetch_page: FetchPage,
+    title: str | None = None,
+    rows_per_page: int = 10,
+    row_key: str = 'id',
+    sort_by: str | None = None,
+    descending: bool = False,
+    selection: str | None = None,
+) -> ServerSideTable:
+    table = ServerSideTable(
+        columns,
+        fetch_page,
+        row_key=row_key,
+        title=title,
+        selection=selection,
+        pagination={'page': 1, 'rowsPerPage': rows_per_page, 'sortBy': sort_by, 'descending': descending, 'rowsNumber': 0},
+    ).props(':rows-per-page-options="[5, 10, 25, 50, 100]"')
+    await table.reload()
+
+    return table
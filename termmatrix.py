@@ -0,0 +1,62 @@
+import numpy
+import scipy.sparse
+
+from collections.abc import Sequence
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+from tables import Frequencies
+
+
+def frequency_columns(frequencies: Frequencies) -> tuple[Sequence[str], numpy.ndarray]:
+    # a document dictionary as (terms, counts), however it was decoded
+    if isinstance(frequencies, dict):
+        return list(frequencies), numpy.fromiter(frequencies.values(), dtype=numpy.int64, count=len(frequencies))
+    terms, counts = frequencies
+    return terms, numpy.asarray(counts, dtype=numpy.int64)
+
+
+def encode_terms(terms: Sequence[Sequence[str]]) -> tuple[numpy.ndarray, numpy.ndarray]:
+    # the vocabulary and, for every term of every document, its position in it
+    if pyarrow is not None:
+        # hashed by Arrow, without ever building a Python string per term
+        encoded = pyarrow.compute.dictionary_encode(pyarrow.concat_arrays([
+            i.cast(pyarrow.string()) if isinstance(i, pyarrow.Array) else pyarrow.array(i, pyarrow.string()) for i in terms
+        ]))
+        return encoded.dictionary.to_numpy(zero_copy_only=False), encoded.indices.to_numpy(zero_copy_only=False)
+
+    vocabulary, term_ids = numpy.unique(numpy.concatenate([numpy.asarray(i, dtype=str) for i in terms]), return_inverse=True)
+    return vocabulary.astype(object), term_ids
+
+
+def term_matrix(dictionaries: Sequence[Frequencies]) -> tuple[scipy.sparse.csr_matrix, numpy.ndarray]:
+    # documents × terms counts and the term of every column
+    columns = [frequency_columns(i) for i in dictionaries]
+    vocabulary, term_ids = encode_terms([i[0] for i in columns] or [[]])
+    counts = numpy.concatenate([i[1] for i in columns] or [numpy.zeros(0, dtype=numpy.int64)])
+    document_ids = numpy.repeat(numpy.arange(len(columns)), [len(i[1]) for i in columns])
+
+    matrix = scipy.sparse.csr_matrix((counts, (document_ids, term_ids)), shape=(len(columns), len(vocabulary)))
+    matrix.eliminate_zeros()
+    return matrix, vocabulary
+
+
+def term_statistics(dictionaries: Sequence[Frequencies]) -> dict[str, numpy.ndarray]:
+    # per term: occurrences in the corpus, number of documents it occurs in and its mean TF-IDF over the documents
+    matrix, vocabulary = term_matrix(dictionaries)
+    documents = matrix.shape[0]
+
+    frequency = numpy.asarray(matrix.sum(axis=0)).ravel()
+    document_frequency = matrix.getnnz(axis=0)
+
+    # term frequencies relative to the document length, and the smoothed IDF of scikit-learn
+    lengths = numpy.asarray(matrix.sum(axis=1)).ravel()
+    tf = scipy.sparse.diags(1 / numpy.maximum(lengths, 1)) @ matrix
+    idf = numpy.log((1 + documents) / (1 + document_frequency)) + 1
+    tf_idf = numpy.asarray(tf.sum(axis=0)).ravel() * idf / max(documents, 1)
+
+    return {'term': vocabulary, 'frequency': frequency, 'documents': document_frequency, 'tf_idf': tf_idf.round(6)}
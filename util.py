@@ -1,34 +1,182 @@
 import util
-from nicegui import app, ui
+from nicegui import app, background_tasks, context, ui
 from functools import partial
-import requests, urllib, os
+import asyncio, base64, heapq, httpx, json, math, re, urllib.parse, os, time
 
-from collections.abc import Callable
+from collections.abc import Awaitable, Callable
 from typing import Any
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+from cache import TTLCache
+import httpcache
+import metrics
+import tables
+
 VERIFY_SSL = os.getenv('VERIFY_SSL', False)
 CORPOGRAFO_API_URL = os.getenv('CORPOGRAFO_API_URL', 'https://127.0.0.1:5000')
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', 20))
+API_TIMEOUT = float(os.getenv('API_TIMEOUT', 30))
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', 1024))
+LOOKUP_CACHE_TTL = float(os.getenv('LOOKUP_CACHE_TTL', 60))
+TOTALS_TTL = float(os.getenv('TOTALS_TTL', 300))
+TEXT_PAGE_SIZE = int(os.getenv('TEXT_PAGE_SIZE', 5000))
+REGEX_CACHE_SIZE = int(os.getenv('REGEX_CACHE_SIZE', 256))
+REGEX_CACHE_TTL = float(os.getenv('REGEX_CACHE_TTL', 600))
+REGEX_CACHE_BYTES = int(os.getenv('REGEX_CACHE_BYTES', 256 * 1024 * 1024))
+DECODED_CACHE_SIZE = int(os.getenv('DECODED_CACHE_SIZE', 64))
+DECODED_CACHE_TTL = float(os.getenv('DECODED_CACHE_TTL', 600))
+DECODED_CACHE_BYTES = int(os.getenv('DECODED_CACHE_BYTES', 256 * 1024 * 1024))
+TOKEN_REFRESH_MARGIN = float(os.getenv('TOKEN_REFRESH_MARGIN', 300))
+TOKEN_REFRESH_ENDPOINT = os.getenv('TOKEN_REFRESH_ENDPOINT', 'refresh')
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', 8))
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', 20))
+SEARCH_DEBOUNCE = float(os.getenv('SEARCH_DEBOUNCE', 0.3))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 4096))
+
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+MSGPACK = 'application/msgpack'
+# analyses are asked for in the most compact encoding this process can read; httpx negotiates gzip and zstd on its own
+ANALYSIS_HEADERS = {'Accept': ', '.join(
+    [ARROW_STREAM] * (pyarrow is not None) + [f'{MSGPACK};q=0.9'] * (msgpack is not None) + ['application/json;q=0.5']
+)}
 
 input_required = {'Required': lambda value: len(value) > 0}
 
-def notify_error(response: requests.Response):
+def error_message(response: httpx.Response) -> str:
+    try:
+        json = response.json()
+        return str(json.get('message', json) if isinstance(json, dict) else json)
+    except ValueError:
+        return 'unexpected behavior'
+
+def notify_error(response: httpx.Response):
     print('ERRO!!!'*22)
     print(response.content)
+    ui.notify(f'Operation failed: {error_message(response)}', color='negative')
+
+api_client: httpx.AsyncClient | None = None
+
+def get_api_client() -> httpx.AsyncClient:
+    # one pooled client per process, so keep-alive connections are shared by every page and user
+    global api_client
+    if api_client is None:
+        api_client = httpx.AsyncClient(
+            verify=VERIFY_SSL,
+            timeout=API_TIMEOUT,
+            limits=httpx.Limits(max_connections=API_POOL_SIZE, max_keepalive_connections=API_POOL_SIZE),
+        )
+    return api_client
+
+async def close_api_client() -> None:
+    global api_client
+    if api_client is not None:
+        await api_client.aclose()
+        api_client = None
+
+app.on_shutdown(close_api_client)
+
+def auth_headers() -> dict[str, str]:
+    return {'Authorization': f'Bearer {app.storage.user.get("access_token")}'}
+
+def token_expiry(token: str | None) -> float | None:
+    # the `exp` claim of a JWT, read without verifying the signature since only the backend can do that
     try:
-        json = response.json()
-        ui.notify(f'Operation failed: {json.get("message", json)}', color='negative')
-    except requests.exceptions.JSONDecodeError:
-        ui.notify(f'Operation failed: unexpected behavior', color='negative')
-
-def api_request(method, endpoint, **json_args):
-    response = requests.request(
-        method,
-        urllib.parse.urljoin(CORPOGRAFO_API_URL, endpoint),
-        json=json_args,
-        headers={'Authorization': f'Bearer {app.storage.user.get("access_token")}'},
-        verify=VERIFY_SSL,
-    )
+        payload = token.split('.')[1]
+        return float(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+def store_session(session: dict[str, Any]) -> None:
+    # decode the expiry once per token instead of on every request
+    app.storage.user.update(session)
+    app.storage.user['token_expires'] = token_expiry(app.storage.user.get('access_token'))
+
+# browser ids with a token refresh running, so a session refreshes once however many requests it makes
+refreshing_sessions: set[str] = set()
+
+async def refresh_access_token(storage: dict[str, Any], session_id: str) -> None:
+    try:
+        r = await send_request('post', TOKEN_REFRESH_ENDPOINT, headers={'Authorization': f'Bearer {storage.get("refresh_token")}'})
+        if r.status_code == 200:
+            storage.update(r.json())
+            storage['token_expires'] = token_expiry(storage.get('access_token'))
+        else:
+            storage.pop('refresh_token', None)  # the token then simply runs out, without retrying on every request
+    except httpx.HTTPError:
+        pass
+    finally:
+        refreshing_sessions.discard(session_id)
+
+def token_valid() -> bool:
+    # False once the access token has expired; shortly before that, refreshes it in the background if possible
+    expires = app.storage.user.get('token_expires')
+    if expires is None:
+        return True
+
+    remaining = expires - time.time()
+    if remaining <= 0:
+        return False
+
+    session_id = app.storage.browser.get('id')
+    if remaining < TOKEN_REFRESH_MARGIN and 'refresh_token' in app.storage.user and session_id not in refreshing_sessions:
+        refreshing_sessions.add(session_id)
+        background_tasks.create(refresh_access_token(app.storage.user, session_id), name='refresh_access_token')
+
+    return True
+
+def expire_session() -> None:
+    referrer_path = app.storage.user.get('referrer_path')
+    app.storage.user.clear()
+    if referrer_path is not None:
+        app.storage.user['referrer_path'] = referrer_path
+
+async def send_request(method, endpoint, headers=None, timeout=None, revalidate=False, **request_args) -> httpx.Response:
+    url = urllib.parse.urljoin(CORPOGRAFO_API_URL, endpoint)
+    revalidate = revalidate and method.lower() == 'get' and httpcache.response_cache is not None
+    cached = None
+    if revalidate:
+        # a copy on disk is only sent again by the backend if it changed; otherwise it answers 304 and the copy is used
+        key = httpcache.cache_key(url, headers or {})
+        cached = await asyncio.to_thread(httpcache.response_cache.get, key)
+        if cached is not None:
+            cached_headers = cached[0]
+            headers = (headers or {}) | (
+                {'If-None-Match': cached_headers['etag']} if 'etag' in cached_headers else {'If-Modified-Since': cached_headers['last-modified']}
+            )
+
+    start = time.perf_counter()
+    try:
+        response = await get_api_client().request(
+            method,
+            url,
+            headers=headers,
+            timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else timeout,
+            **request_args,
+        )
+    except httpx.HTTPError as e:
+        metrics.observe_backend_request(method, endpoint, type(e).__name__, time.perf_counter() - start, None)
+        raise
+
+    metrics.observe_backend_request(method, endpoint, response.status_code, time.perf_counter() - start, len(response.content))
 
+    if revalidate and response.status_code == 304 and cached is not None:
+        await asyncio.to_thread(httpcache.response_cache.touch, key)
+        return httpx.Response(200, headers=cached[0], content=cached[1], request=response.request)
+    if revalidate and response.status_code == 200 and ('etag' in response.headers or 'last-modified' in response.headers):
+        await asyncio.to_thread(httpcache.response_cache.put, key, httpcache.kept_headers(response.headers), response.content)
+    return response
+
+def check_response(response: httpx.Response) -> httpx.Response:
     if response.status_code // 100 != 2:
         notify_error(response)
         if response.status_code == 422 and response.json().get('msg') in set(['Signature verification failed', 'Not enough segments']):
@@ -37,8 +185,290 @@ def api_request(method, endpoint, **json_args):
 
     return response
 
-def logout() -> None:
-    r = api_request('post', 'logout')
+async def can_access(endpoint: str) -> bool:
+    r = await send_request('get', endpoint, headers=auth_headers(), json={})
+    return r.status_code == 200
+
+def fail_shared(future: asyncio.Future, error: BaseException) -> None:
+    # passes the leader's error on to the callers sharing its request; a cancelled leader cancels the future instead,
+    # which tells them to send the request themselves
+    if isinstance(error, asyncio.CancelledError):
+        future.cancel()
+    else:
+        future.set_exception(error)
+        future.exception()  # retrieved, so nobody having joined is not reported as an error
+
+async def join_shared(future: asyncio.Future) -> tuple[bool, Any]:
+    # (True, result) from a shared request, or (False, None) if its leader was cancelled and the caller has to send its own
+    try:
+        return True, await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if not future.cancelled() or asyncio.current_task().cancelling():
+            raise
+        return False, None
+
+# GETs in flight that opted into coalescing, keyed by (method, endpoint, scope)
+inflight_requests: dict[tuple, dict[str, Any]] = {}
+
+async def coalesced_request(method, endpoint, scope, timeout=None, headers=None, revalidate=False, **json_args) -> httpx.Response:
+    # scope True shares the request among callers with the same token; an endpoint shares it with everyone who can read that endpoint
+    token = auth_headers()['Authorization']
+    key = (method.lower(), endpoint, token if scope is True else scope, tuple(sorted((headers or {}).items())))
+    flight = inflight_requests.get(key)
+
+    if flight is not None and (token in flight['tokens'] or await can_access(scope)):
+        flight['tokens'].add(token)
+        joined, response = await join_shared(flight['future'])
+        if joined:
+            return response
+
+    flight = {'future': asyncio.get_running_loop().create_future(), 'tokens': {token}}
+    inflight_requests[key] = flight
+    try:
+        response = await send_request(method, endpoint, headers=auth_headers() | (headers or {}), timeout=timeout, revalidate=revalidate, json=json_args)
+        flight['future'].set_result(response)
+    except BaseException as e:
+        fail_shared(flight['future'], e)
+        raise
+    finally:
+        if inflight_requests.get(key) is flight:
+            del inflight_requests[key]
+
+    return response
+
+async def api_request(method, endpoint, timeout=None, coalesce: bool | str = False, headers=None, revalidate=False, **json_args) -> httpx.Response:
+    if not token_valid():
+        # the backend would only reject the expired token, so skip the round trip and go straight to the login
+        expire_session()
+        ui.navigate.to('/login')
+        return httpx.Response(401, json={'message': 'Token has expired'})
+
+    if coalesce and method.lower() == 'get':
+        response = await coalesced_request(method, endpoint, coalesce, timeout=timeout, headers=headers, revalidate=revalidate, **json_args)
+    else:
+        response = await send_request(method, endpoint, headers=auth_headers() | (headers or {}), timeout=timeout, revalidate=revalidate, json=json_args)
+    return check_response(response)
+
+async def request_analysis(endpoint: str, coalesce: bool | str = True) -> Any:
+    # None when the request failed, which api_request has already shown to the user
+    response = await api_request('get', endpoint, coalesce=coalesce, headers=ANALYSIS_HEADERS, revalidate=True)
+    return decode_analysis(response) if response.status_code == 200 else None
+
+# decoded analyses by (url, content type, ETag), so a result confirmed by a 304 is not parsed again
+decoded_cache = TTLCache(maxsize=DECODED_CACHE_SIZE, ttl=DECODED_CACHE_TTL, max_bytes=DECODED_CACHE_BYTES)
+
+def decode_analysis(response: httpx.Response) -> Any:
+    etag = response.headers.get('etag')
+    if etag is None:
+        return parse_analysis(response)
+
+    key = (str(response.request.url), response.headers.get('content-type'), etag)
+    result = decoded_cache.get(key)
+    if result is None:
+        result = parse_analysis(response)
+        decoded_cache.set(key, result)
+    return result
+
+def parse_analysis(response: httpx.Response) -> Any:
+    # [name, result] where frequency results may come as a (terms, frequencies) pair of columns instead of a dict:
+    # Arrow streams carry the name in the schema metadata and one (list) or two (terms, frequencies) columns,
+    # msgpack bodies are [name, {'terms': [...], 'frequencies': [...]}] or the same shape as the JSON
+    content_type = response.headers.get('content-type', '').split(';')[0].strip()
+
+    if content_type == ARROW_STREAM and pyarrow is not None:
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        name = (table.schema.metadata or {}).get(b'name', b'').decode()
+        columns = [i.combine_chunks() for i in table.columns]
+        return [name, tuple(columns) if len(columns) == 2 else columns[0].to_pylist()]
+
+    if content_type == MSGPACK and msgpack is not None:
+        name, result = msgpack.unpackb(response.content, strict_map_key=False)
+        if isinstance(result, dict) and result.keys() == {'terms', 'frequencies'}:
+            result = (result['terms'], result['frequencies'])
+        return [name, result]
+
+    return response.json()
+
+# reference lists for selects, keyed by (user, endpoint)
+lookup_cache = TTLCache(maxsize=LOOKUP_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+
+def user_scope() -> str | None:
+    return app.storage.user.get('email')
+
+def invalidate_lookups(entity: str) -> None:
+    # entities can be shared, so a change is visible to every user's cached list
+    lookup_cache.invalidate(lambda key: key[1] == entity)
+    search_cache.invalidate(lambda key: key[1] == entity)
+
+# lookups currently being fetched, so concurrent selects on the same endpoint share one request
+pending_lookups: dict[tuple[str | None, str], asyncio.Future] = {}
+
+async def entity_options(entity: str) -> dict[int | None, str]:
+    key = (user_scope(), entity)
+    options = lookup_cache.get(key)
+
+    if options is None and key in pending_lookups:
+        joined, options = await join_shared(pending_lookups[key])
+        if not joined:
+            return await entity_options(entity)
+
+    elif options is None:
+        pending_lookups[key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await api_request('get', entity)
+            options = {None: 'Undefined'}
+            if response.status_code == 200:
+                options |= {i['id']: i['name'] for i in response.json()}
+                lookup_cache.set(key, options)
+            pending_lookups[key].set_result(options)
+        except BaseException as e:
+            fail_shared(pending_lookups[key], e)
+            raise
+        finally:
+            del pending_lookups[key]
+
+    return dict(options)
+
+# matches typed into entity pickers, keyed by (user, entity, query)
+search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=LOOKUP_CACHE_TTL)
+
+# per entity, whether the backend answers list requests with pages of search results; missing until it has been asked
+search_endpoint_available: dict[str, bool] = {}
+
+async def search_entities(entity: str, query: str) -> dict[int, str]:
+    query = query.strip().lower()
+    key = (user_scope(), entity, query)
+    matches = search_cache.get(key)
+    if matches is not None:
+        return dict(matches)
+
+    if search_endpoint_available.get(entity, True):
+        # the same paging parameters as the list pages, so only the first matches leave the backend
+        params = urllib.parse.urlencode({'page': 1, 'per_page': SEARCH_RESULTS, 'sort_by': 'name', 'descending': False, 'filter': query})
+        response = await api_request('get', f'{entity}?{params}', coalesce=True)
+        if response.status_code != 200:
+            return {}
+        result = response.json()
+        search_endpoint_available[entity] = isinstance(result, dict)
+        if isinstance(result, dict):
+            matches = {i['id']: i['name'] for i in result['items']}
+        else:
+            # the whole list came back anyway, so it becomes the lookup list searched below instead of being fetched again
+            lookup_cache.set((user_scope(), entity), {None: 'Undefined'} | {i['id']: i['name'] for i in result})
+
+    if matches is None:
+        # the backend ignores the paging parameters: search the cached lookup list instead
+        options = await entity_options(entity)
+        matches = dict(heapq.nsmallest(
+            SEARCH_RESULTS,
+            ((i, j) for i, j in options.items() if i is not None and query in j.lower()),
+            key=lambda i: i[1].lower(),
+        ))
+
+    search_cache.set(key, matches)
+    return dict(matches)
+
+def entity_picker(entity: str, multiple: bool = False) -> ui.select:
+    # starts empty and asks the server for matches as the user types, so it never waits for the whole collection
+    picker = ui.select({}, label=f'Which {entity}?', with_input=True, multiple=multiple)
+    if multiple:
+        picker.props('use-chips')
+    latest_query = None
+
+    async def search(query: str) -> None:
+        nonlocal latest_query
+        latest_query = query
+        matches = await search_entities(entity, query)
+        if query != latest_query:
+            return
+
+        # selected options stay, or their chips would lose their labels
+        selected = picker.value if multiple else [picker.value]
+        picker.options = {i: picker.options[i] for i in selected if i in picker.options} | matches
+        picker.update()
+
+    picker.on('input-value', lambda e: search(e.args or ''), throttle=SEARCH_DEBOUNCE, leading_events=False)
+    ui.timer(0, partial(search, ''), once=True)
+    return picker
+
+# regex analyses shared by every user, keyed by (corpus_id, regex, case_sensitive, left, right)
+regex_cache = TTLCache(maxsize=REGEX_CACHE_SIZE, ttl=REGEX_CACHE_TTL, max_bytes=REGEX_CACHE_BYTES)
+
+async def cached_analysis(cache: TTLCache, key: tuple, endpoint: str) -> Any:
+    entry = cache.get(key)
+    scope = user_scope()
+
+    if entry is not None and scope not in entry['scopes']:
+        # a result computed for someone else is only reused once this user is known to see the corpus
+        if await can_access(f'corpus/{key[0]}'):
+            entry['scopes'].add(scope)
+        else:
+            entry = None
+
+    if entry is None:
+        result = await request_analysis(endpoint, coalesce=f'corpus/{key[0]}')
+        if result is None:
+            return None
+        entry = {'result': result, 'scopes': {scope}}
+        cache.set(key, entry)
+
+    return entry['result']
+
+def invalidate_corpus_results(endpoint: str) -> None:
+    # linking or unlinking documents changes what a corpus analysis returns
+    match = re.match(r'/?corpus/(\d+)/document/', endpoint)
+    if match is not None:
+        corpus_id = int(match.group(1))
+        regex_cache.invalidate(lambda key: key[0] == corpus_id)
+
+async def gather(*awaitables) -> list[Any]:
+    # asyncio.gather runs each awaitable in its own task; re-enter the caller's slot so they can still notify
+    slot = context.slot
+
+    async def in_slot(awaitable):
+        with slot:
+            return await awaitable
+
+    return await asyncio.gather(*(in_slot(i) for i in awaitables))
+
+# per entity, whether the backend answered its `<entity>/count` endpoint; missing until it has been probed
+count_endpoint_available: dict[str, bool] = {}
+
+async def fetch_count(entity: str) -> int | None:
+    # None when the count is unknown, including when the backend cannot be reached
+    headers = auth_headers()
+
+    try:
+        if count_endpoint_available.get(entity, True):
+            response = await send_request('get', f'{entity}/count', headers=headers)
+            if response.status_code // 100 == 2:
+                count_endpoint_available[entity] = True
+                count = response.json()
+                return count['count'] if isinstance(count, dict) else int(count)
+            elif response.status_code in (401, 403):
+                return None
+            else:
+                # missing, or answered by another route such as `<entity>/{id}`: count the list instead; an endpoint
+                # that already worked is only failing for now, so it is asked again next time
+                count_endpoint_available.setdefault(entity, False)
+
+        response = await send_request('get', entity, headers=headers, json={})
+    except httpx.HTTPError:
+        return None
+
+    if response.status_code == 200:
+        return len(response.json())
+
+def mark_totals_stale() -> None:
+    totals = app.storage.user.get('totals')
+    if totals is not None:
+        app.storage.user['totals'] = totals | {'updated': 0}
+
+async def logout() -> None:
+    r = await api_request('post', 'logout')
+    scope = user_scope()
+    lookup_cache.invalidate(lambda key: key[0] == scope)
+    search_cache.invalidate(lambda key: key[0] == scope)
     app.storage.user.clear()
     if r.status_code == 200:
         ui.navigate.to('/login')
@@ -58,6 +488,7 @@ def make_header_and_menu() -> None:
         with ui.menu_item('Document'):
             with ui.menu() as menu:
                 ui.menu_item('New', on_click=partial(ui.navigate.to, '/new_document'))
+                ui.menu_item('Bulk upload', on_click=partial(ui.navigate.to, '/bulk_documents'))
                 ui.menu_item('List', on_click=partial(ui.navigate.to, '/document'))
 
         with ui.menu_item('Language'):
@@ -75,6 +506,8 @@ def make_header_and_menu() -> None:
                 ui.menu_item('New', on_click=partial(ui.navigate.to, '/new_author'))
                 ui.menu_item('List', on_click=partial(ui.navigate.to, '/author'))
 
+        ui.menu_item('Analyses', on_click=partial(ui.navigate.to, '/jobs'))
+
         ui.separator()
         ui.menu_item('Logout', on_click=logout)
 
@@ -93,32 +526,32 @@ async def share_with_user(entity_name, entity_id, to_refresh):
 
     user_email = await dialog
     if user_email is not None:
-        response = api_request('post', f'{entity_name}/{entity_id}/user/{user_email}')
+        response = await api_request('post', f'{entity_name}/{entity_id}/user/{user_email}')
         if response.status_code == 200:
             ui.notify('Operation successful', color='positive')
             to_refresh.refresh()
         else:
             notify_error(response)
 
-def unshare_with_user(entity_name, entity_id, user_id, to_refresh):
-    response = api_request('delete', f'{entity_name}/{entity_id}/user/{user_id}')
+async def unshare_with_user(entity_name, entity_id, user_id, to_refresh):
+    response = await api_request('delete', f'{entity_name}/{entity_id}/user/{user_id}')
     if response.status_code == 200:
         ui.notify('Operation successful', color='positive')
         to_refresh.refresh()
     else:
         notify_error(response)
 
-def make_users_tbl(rows, entity_name, entity_id, to_refresh):
-    users_tbl = ui.table(
-        title='Users',
-        columns=[
+async def make_users_tbl(rows, entity_name, entity_id, to_refresh):
+    users_tbl = (await tables.make_server_side_table(
+        [
             {'name': 'name', 'label':'Name', 'field': 'name'},
             {'name': 'email', 'label':'E-mail', 'field': 'email'},
             {'name': 'unshare', 'label':'', 'field': ''},
         ],
-        rows=rows,
-        pagination=5,
-    ).props('bordered').classes('w-full')
+        tables.PagedRows(rows, ['name', 'email']).fetch_page,
+        title='Users',
+        rows_per_page=5,
+    )).props('bordered').classes('w-full')
 
     users_tbl.add_slot(
         'body',
@@ -142,19 +575,19 @@ def make_users_tbl(rows, entity_name, entity_id, to_refresh):
     with users_tbl.add_slot('top-right'):
         with ui.column().classes('items-right'):
             ui.button('Share', on_click=partial(share_with_user, entity_name, entity_id, to_refresh)).classes('w-full')
-            users_tbl.bind_filter(ui.input('Filter'), 'value')
+            tables.filter_input(users_tbl)
 
 
-def make_docs_corpora_tbl(title, entity, rows, reference_id, to_refresh):
-    tbl = ui.table(
-        title=title,
-        columns=[
+async def make_docs_corpora_tbl(title, entity, rows, reference_id, to_refresh):
+    tbl = (await tables.make_server_side_table(
+        [
             {'name': 'name', 'label':'Name', 'field': 'name'},
             {'name': 'operations', 'label':'', 'field': ''},
         ],
-        rows=rows,
-        pagination=5,
-    ).props('bordered').classes('w-full')
+        tables.PagedRows(rows, ['name']).fetch_page,
+        title=title,
+        rows_per_page=5,
+    )).props('bordered').classes('w-full')
 
     tbl.add_slot(
         'body',
@@ -191,14 +624,12 @@ def make_docs_corpora_tbl(title, entity, rows, reference_id, to_refresh):
     with tbl.add_slot('top-right'):
         with ui.column().classes('items-right'):
             ui.button('Link document to corpus', on_click=partial(link_corpus_document, entity, reference_id, to_refresh)).classes('w-full')
-            tbl.bind_filter(ui.input('Filter'), 'value')
+            tables.filter_input(tbl)
 
 async def link_corpus_document(query_entity, reference_id, to_refresh):
     with ui.dialog() as dialog, ui.card():
         #query_entity = 'corpus' if reference_entity == 'document' else 'document'
-        user_entities = api_request('get', query_entity).json()
-        print(user_entities)
-        selected_id = ui.select({i['id']: i['name'] for i in user_entities}, label=f'Which {query_entity}?', with_input=True)
+        selected_id = entity_picker(query_entity)
 
         with ui.row():
             ui.button('OK', on_click=lambda: dialog.submit(selected_id.value))
@@ -213,16 +644,18 @@ async def link_corpus_document(query_entity, reference_id, to_refresh):
             corpus_id = reference_id
             document_id = selected_id
 
-        response = api_request('post', f'corpus/{corpus_id}/document/{document_id}')
+        response = await api_request('post', f'corpus/{corpus_id}/document/{document_id}')
         if response.status_code == 200:
+            invalidate_corpus_results(f'corpus/{corpus_id}/document/{document_id}')
             ui.notify('Operation successful', color='positive')
             to_refresh.refresh()
         else:
             notify_error(response)
 
-def unlink_corpus_document(document_id, corpus_id, to_refresh):
-    response = api_request('delete', f'corpus/{corpus_id}/document/{document_id}')
+async def unlink_corpus_document(document_id, corpus_id, to_refresh):
+    response = await api_request('delete', f'corpus/{corpus_id}/document/{document_id}')
     if response.status_code == 200:
+        invalidate_corpus_results(f'corpus/{corpus_id}/document/{document_id}')
         ui.notify('Operation successful', color='positive')
         to_refresh.refresh()
     else:
@@ -232,35 +665,61 @@ def make_generic_list_entity_page(entity: str, table_title: str | None = None) -
     if table_title is None:
         table_title = entity.capitalize() + 's'
 
-    def list_entity() -> None:
+    async def list_entity() -> None:
         make_header_and_menu()
-        entity_collection = api_request('get', entity).json()
+        # the whole collection, kept only if the backend ignores the paging parameters
+        entity_collection = None
+
+        async def fetch_page(page, rows_per_page, sort_by, descending, filter):
+            nonlocal entity_collection
+
+            if entity_collection is None:
+                query = urllib.parse.urlencode({
+                    'page': page,
+                    'per_page': rows_per_page,
+                    'sort_by': sort_by or '',
+                    'descending': descending,
+                    'filter': filter,
+                })
+                response = await api_request('get', f'{entity}?{query}')
+                if response.status_code != 200:
+                    return [], 0
+
+                result = response.json()
+                if isinstance(result, dict):
+                    return result['items'], result['total']
+
+                entity_collection = tables.PagedRows(result, ['name'])
+
+            return await entity_collection.fetch_page(page, rows_per_page, sort_by, descending, filter)
 
         with ui.card().classes('w-2/3 h-5/6 absolute-center items-center no-shadow'):
             with ui.scroll_area().classes('w-full h-full'):
 
-                table = ui.table(
-                    title=table_title,
-                    columns=[
-                        {'name': 'name', 'label': 'Name', 'field': 'name'}
+                table = (await tables.make_server_side_table(
+                    [
+                        {'name': 'name', 'label': 'Name', 'field': 'name', 'sortable': True}
                     ],
-                    rows=list(entity_collection),
-                    pagination=10,
-                ).on(
+                    fetch_page,
+                    title=table_title,
+                    rows_per_page=10,
+                )).on(
                     'rowClick',
                     lambda event: ui.navigate.to(f'/{entity}/{event.args[-2]["id"]}')
                 ).classes('w-full')
 
                 with table.add_slot('top-right'):
-                    table.bind_filter(ui.input('Filter'), 'value')
+                    tables.filter_input(table)
 
     return list_entity
 
 
-def create_entity(entity, fields):
-    r = api_request('post', entity, **{i: fields[i]['input'].value for i in fields})
+async def create_entity(entity, fields):
+    r = await api_request('post', entity, **{i: fields[i]['input'].value for i in fields})
 
     if r.status_code == 201:
+        invalidate_lookups(entity)
+        mark_totals_stale()
         ui.navigate.to(f'/{entity}/{r.json()["id"]}')
     else:
         util.notify_error(r)
@@ -280,55 +739,202 @@ def make_generic_new_entity_page(entity: str, fields: dict[str, dict[str, Any]])
 
     return create_entity_page
 
-def update_entity(entity, entity_id, fields):
-    r = api_request('put', f'{entity}/{entity_id}', **{i: fields[i]['input'].value for i in fields if fields[i]['input_type'] != 'table'})
+async def update_entity(entity, entity_id, fields):
+    # lazy fields that were never opened for editing have no input and are left untouched
+    r = await api_request('put', f'{entity}/{entity_id}', **{i: fields[i]['input'].value for i in fields if fields[i]['input_type'] != 'table' and fields[i]['input'] is not None})
 
     if r.status_code == 200:
+        invalidate_lookups(entity)
         ui.notify('Operation successful', color='positive')
     else:
         util.notify_error(r)
+    return r.status_code == 200
+
+async def bulk_request(method: str, endpoints: dict[Any, str], on_progress: Callable[[int], None] | None = None) -> dict[Any, str]:
+    # one request per item with at most BULK_CONCURRENCY in flight; returns the error message of every item that failed
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    headers = auth_headers()
+    failures = {}
+    done = 0
+
+    async def send(item, endpoint):
+        nonlocal done
+        async with semaphore:
+            try:
+                response = await send_request(method, endpoint, headers=headers, json={})
+                if response.status_code // 100 != 2:
+                    failures[item] = error_message(response)
+            except httpx.HTTPError as e:
+                failures[item] = str(e) or type(e).__name__
+        done += 1
+        if on_progress is not None:
+            on_progress(done)
+
+    await asyncio.gather(*(send(i, j) for i, j in endpoints.items()))
+    return failures
+
+async def run_bulk(method: str, endpoints: dict[Any, str], action: str, names: dict[Any, str]) -> dict[Any, str]:
+    if not token_valid():
+        expire_session()
+        ui.navigate.to('/login')
+        return dict.fromkeys(endpoints, 'Token has expired')
+
+    with ui.dialog().props('persistent') as dialog, ui.card():
+        ui.label(f'{action} {len(endpoints)} items...')
+        progress = ui.linear_progress(value=0, show_value=False)
+    dialog.open()
+    try:
+        failures = await bulk_request(method, endpoints, lambda done: progress.set_value(done / len(endpoints)))
+    finally:
+        dialog.delete()
 
-async def link_entities(query_entity:str, endpoint_spec:str, reference_id:int, refresh:Callable):
+    for item, endpoint in endpoints.items():
+        if item not in failures:
+            invalidate_corpus_results(endpoint)
+
+    if not failures:
+        ui.notify(f'{action} {len(endpoints)} items: done', color='positive')
+    else:
+        ui.notify(f'{action} {len(endpoints)} items: {len(failures)} failed', color='warning')
+        with ui.dialog() as report, ui.card():
+            ui.table(
+                [
+                    {'name': 'name', 'label': 'Item', 'field': 'name', 'align': 'left'},
+                    {'name': 'error', 'label': 'Error', 'field': 'error', 'align': 'left'},
+                ],
+                [{'id': i, 'name': names.get(i, i), 'error': j} for i, j in failures.items()],
+                title=f'{action}: failed items',
+            )
+            ui.button('Close', on_click=report.close)
+        report.open()
+
+    return failures
+
+async def link_entities(query_entity:str, endpoint_spec:str, reference_id:int, on_linked:Callable[..., Awaitable]):
     with ui.dialog() as dialog, ui.card():
         #query_entity = 'corpus' if reference_entity == 'document' else 'document'
-        user_entities = api_request('get', query_entity).json()
-        #print(user_entities)
-        selected_id = ui.select({i['id']: i['name'] for i in user_entities}, label=f'Which {query_entity}?', with_input=True)
+        selector = entity_picker(query_entity, multiple=True)
 
         with ui.row():
-            ui.button('OK', on_click=lambda: dialog.submit(selected_id.value))
+            ui.button('OK', on_click=lambda: dialog.submit(selector.value))
             ui.button('Cancel', on_click=lambda: dialog.submit(None))
 
-    selected_id = await dialog
-    if selected_id is not None:
-        response = api_request('post', endpoint_spec.format(reference_id=reference_id, selected_id=selected_id))
-        if response.status_code == 200:
-            ui.notify('Operation successful', color='positive')
-            refresh()
-        else:
-            notify_error(response)
+    selected_ids = await dialog
+    if selected_ids:
+        endpoints = {i: endpoint_spec.format(reference_id=reference_id, selected_id=i) for i in selected_ids}
+        failures = await run_bulk('post', endpoints, 'Linking', selector.options)
+        linked = [{'id': i, 'name': selector.options[i]} for i in selected_ids if i not in failures]
+        if linked:
+            await on_linked(*linked)
 
-def unlink_entities(endpoint, refresh):
-    response = api_request('delete', endpoint)
+async def unlink_entities(endpoint, on_unlinked):
+    response = await api_request('delete', endpoint)
     if response.status_code == 200:
+        invalidate_corpus_results(endpoint)
         ui.notify('Operation successful', color='positive')
-        refresh()
+        await on_unlinked()
     else:
         notify_error(response)
 
+async def unlink_selected(endpoint_spec: str, reference_id: int, tbl: tables.ServerSideTable, on_unlinked: Callable[..., Awaitable]):
+    selected = {i['id']: i for i in tbl.selected}
+    if not selected:
+        ui.notify('Select the rows to unlink first')
+        return
+
+    endpoints = {i: endpoint_spec.format(reference_id=reference_id, selected_id=i) for i in selected}
+    failures = await run_bulk('delete', endpoints, 'Unlinking', {i: j['name'] for i, j in selected.items()})
+    tbl.selected = [j for i, j in selected.items() if i in failures]
+    await on_unlinked(*(j for i, j in selected.items() if i not in failures))
+
+
+# link/unlink only touch the affected relation table, so the rest of the page (and unsaved edits) stay as they are
+async def relation_linked(rows: tables.PagedRows, tbl: tables.ServerSideTable, *linked: dict) -> None:
+    rows.add(*linked)
+    await tbl.reload()
+
+async def relation_unlinked(rows: tables.PagedRows, tbl: tables.ServerSideTable, *unlinked: dict) -> None:
+    rows.remove(*unlinked)
+    await tbl.reload()
+
+def make_lazy_text(label: str, field: dict[str, Any], load_text: Callable[[], Awaitable[str | None]]) -> None:
+    # large text is only fetched when the expansion is opened, and only one page of it is sent to the browser;
+    # load_text gives None when it could not be fetched, and then nothing is shown or made editable
+    field['input'] = None
+
+    async def edit():
+        text = await load_text()
+        if text is None:
+            return
+        container.clear()
+        with container:
+            field['input'] = ui.textarea(label, value=text).classes('w-full')
+
+    async def show():
+        if container.default_slot.children:
+            return
+
+        text = await load_text()
+        if text is None:
+            return
+        with container:
+            page = ui.label(text[:TEXT_PAGE_SIZE]).classes('w-full whitespace-pre-wrap')
+            with ui.row().classes('items-center'):
+                if len(text) > TEXT_PAGE_SIZE:
+                    ui.pagination(
+                        1,
+                        math.ceil(len(text) / TEXT_PAGE_SIZE),
+                        direction_links=True,
+                        on_change=lambda e: page.set_text(text[(e.value - 1) * TEXT_PAGE_SIZE:e.value * TEXT_PAGE_SIZE]),
+                    )
+                ui.button('Edit', on_click=edit)
+
+    with ui.expansion(label, on_value_change=lambda e: show() if e.value else None).classes('w-full'):
+        container = ui.column().classes('w-full')
 
 def make_generic_detail_entity_page(entity: str, fields: dict[str, dict[str, Any]], make_ops_menu: Callable[[int], None]=None) -> Callable[[int], None]:
-    def detail_entity(entity_id):
+    lazy_fields = [i for i in fields if fields[i]['input_type'] == 'lazy_textarea']
+
+    async def detail_entity(entity_id):
+        # values of lazy fields, fetched once per page view when first opened
+        lazy_values = {}
+
+        async def load_lazy(field_name):
+            if field_name not in lazy_values:
+                response = await api_request('get', f'{entity}/{entity_id}')
+                if response.status_code != 200:
+                    return None
+                lazy_values.update({i: response.json().get(i) or '' for i in lazy_fields})
+            return lazy_values[field_name]
+
+        async def save():
+            if await update_entity(entity, entity_id, fields):
+                lazy_values.clear()  # the next Edit has to show what was just saved, not the text loaded before
+
         @ui.refreshable
-        def render_page():
-            entity_item = api_request('get', f'{entity}/{entity_id}').json()
+        async def render_page():
+            # fetch the entity and every select's options at once, and only start rendering when all have arrived
+            select_fields = [i for i in fields if fields[i]['input_type'] == 'select']
+            entity_endpoint = f'{entity}/{entity_id}'
+            if lazy_fields:
+                entity_endpoint += '?' + urllib.parse.urlencode({'exclude': ','.join(lazy_fields)})
+            entity_response, *select_options = await gather(
+                api_request('get', entity_endpoint),
+                *(fields[i]['options_maker']() for i in select_fields),
+            )
+            if entity_response.status_code != 200:
+                return
+            entity_item = entity_response.json()
+            for i in lazy_fields:
+                entity_item.pop(i, None)
+            select_options = dict(zip(select_fields, select_options))
 
             with ui.card().classes('w-2/3 h-5/6 absolute-center no-shadow'):
                 with ui.scroll_area().classes('w-full h-full'):
                     ui.label(f'{entity.capitalize()} detailing').style('font-size: 150%')
 
                     with ui.row():
-                        ui.button('Save changes', on_click=partial(update_entity, entity, entity_id, fields))
+                        ui.button('Save changes', on_click=save)
 
                         if make_ops_menu is not None:
                             with ui.button('Operations'):
@@ -337,15 +943,17 @@ def make_generic_detail_entity_page(entity: str, fields: dict[str, dict[str, Any
 
                     for i in fields:
                         if fields[i]['input_type'] == 'table':
-                            tbl = ui.table(
-                                title=i.capitalize(),
-                                columns=[
+                            relation_rows = tables.PagedRows(entity_item[i], ['name'])
+                            tbl = (await tables.make_server_side_table(
+                                [
                                     {'name': 'name', 'label':'Name', 'field': 'name'},
                                     {'name': 'operations', 'label':'', 'field': ''},
                                 ],
-                                rows=entity_item[i],
-                                pagination=5,
-                            ).props('bordered').classes('w-full')
+                                relation_rows.fetch_page,
+                                title=i.capitalize(),
+                                rows_per_page=5,
+                                selection='multiple' if 'link_endpoint' in fields[i] else None,
+                            )).props('bordered').classes('w-full')
 
                             operations_slot = r'''
                                 <q-td :props="props" style="width:0%;">
@@ -355,8 +963,13 @@ def make_generic_detail_entity_page(entity: str, fields: dict[str, dict[str, Any
                                 tbl.on(
                                     'unlink',
                                     partial(
-                                        (lambda i, event: unlink_entities(fields[i]['link_endpoint'].format(selected_id=event.args["id"], reference_id=entity_id), render_page.refresh)),
+                                        (lambda i, rows, tbl, event: unlink_entities(
+                                            fields[i]['link_endpoint'].format(selected_id=event.args["id"], reference_id=entity_id),
+                                            partial(relation_unlinked, rows, tbl, event.args),
+                                        )),
                                         i,
+                                        relation_rows,
+                                        tbl,
                                     )
                                 )
 
@@ -386,15 +999,25 @@ def make_generic_detail_entity_page(entity: str, fields: dict[str, dict[str, Any
                                                 fields[i]['entity'],
                                                 fields[i]['link_endpoint'],
                                                 entity_id,
-                                                render_page.refresh,
+                                                partial(relation_linked, relation_rows, tbl),
+                                            )
+                                        ).classes('w-full')
+                                        ui.button(
+                                            'Unlink selected',
+                                            on_click=partial(
+                                                unlink_selected,
+                                                fields[i]['link_endpoint'],
+                                                entity_id,
+                                                tbl,
+                                                partial(relation_unlinked, relation_rows, tbl),
                                             )
                                         ).classes('w-full')
-                                    tbl.bind_filter(ui.input('Filter'), 'value')
+                                    tables.filter_input(tbl)
 
 
                         elif fields[i]['input_type'] == 'select':
                             input_kwargs = dict(
-                                options=fields[i]['options_maker'](),
+                                options=select_options[i],
                                 label=i.capitalize(),
                                 value=entity_item[i],
                                 with_input=True,
@@ -414,6 +1037,8 @@ def make_generic_detail_entity_page(entity: str, fields: dict[str, dict[str, Any
                                     btn.bind_visibility_from(fields[i]['input'], 'value', lambda x: x is not None)
                             else:
                                 fields[i]['input'] = ui.select(**input_kwargs).classes('w-full')
+                        elif fields[i]['input_type'] == 'lazy_textarea':
+                            make_lazy_text(i.capitalize(), fields[i], partial(load_lazy, i))
                         else:
                             input_kwargs = dict(
                                 label=i.capitalize(),
@@ -422,6 +1047,6 @@ def make_generic_detail_entity_page(entity: str, fields: dict[str, dict[str, Any
                             input_kwargs |=  fields[i].get('input_kwargs', {})
                             fields[i]['input'] = getattr(ui, fields[i]['input_type'])(**input_kwargs).classes('w-full')
 
-        render_page()
+        await render_page()
         util.make_header_and_menu()
     return detail_entity
\ No newline at end of file